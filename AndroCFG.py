@@ -1,23 +1,120 @@
 #!/usr/bin/env python3
 import argparse
+import json
+import os
 
-from androcfg.call_graph_extractor import CFG
+from androcfg.analysis_cache import file_sha256
+from androcfg.batch import Batch, collect_apks
+from androcfg.call_graph_extractor import CFG, CLUSTERS, RULES_FILE
+from androcfg.genom_corpus import GenomCorpus
+from androcfg.rule_pack import RulePack
+from androcfg.source_archive import render_finding
+
+
+def print_similar(corpus: GenomCorpus, similar: list):
+    for row, score in similar:
+        print(json.dumps({'score': score, **corpus.samples[row]}))
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("-a", "--apk", help="APK to be analyzed", type=str, required=True)
-    parser.add_argument("-o", "--output", help="Output directory", type=str, required=True)
-    parser.add_argument("-r", "--rules", help="JSON file containing rules", type=str, required=False)
-    parser.add_argument("-f", "--file", help="Sets the output file type for the code extraction (bmp, html, raw). Default is bmp", type=str, choices=['bmp', 'html', 'raw'], required=False)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("-a", "--apk", help="APK to be analyzed", type=str)
+    source.add_argument("-b", "--batch", help="Directory, file listing APK paths or glob pattern of APKs to be analyzed", type=str)
+    source.add_argument("-e", "--evidence", help="Renders the evidence file of the finding with this id, from a report of OUTPUT generated with --lazy", type=str)
+    source.add_argument("-p", "--compile-rules", help="Compiles the rules of RULES, or the default rules, into this rule pack file usable as RULES", type=str, metavar="PACK")
+    source.add_argument("-s", "--similar", help="Prints the samples of CORPUS most similar to the APK of CORPUS with this sha256", type=str, metavar="SHA256")
+    parser.add_argument("-o", "--output", help="Output directory, not used by --similar and --compile-rules", type=str, required=False)
+    parser.add_argument("-r", "--rules", help="JSON file containing rules, or rule pack compiled by --compile-rules", type=str, required=False)
+    parser.add_argument("-f", "--file", help="Sets the output file type for the code extraction (bmp, png, webp, html, raw). Default is bmp", type=str, choices=['bmp', 'png', 'webp', 'html', 'raw'], default='bmp', required=False)
+    parser.add_argument("-c", "--compact", help="Stores the call graph as integer-indexed arrays, lowers memory usage on large APKs", action='store_true')
+    parser.add_argument("-w", "--rule-workers", help="Number of rules evaluated in parallel for each APK. Default is 1", type=int, default=1, required=False)
+    parser.add_argument("-g", "--graph-format", help="Sets the output file type of the call graphs (png, svg, dot). dot skips the graphviz layout. Default is png", type=str, choices=['png', 'svg', 'dot'], default='png', required=False)
+    parser.add_argument("--render-processes", help="Maximum number of graphviz processes laying out call graphs concurrently. Default is the number of CPUs", type=int, required=False)
+    parser.add_argument("-l", "--lazy", help="Archives the source code of the findings instead of rendering their evidence files, which are rendered on demand with --evidence", action='store_true')
+    parser.add_argument("--evidence-processes", help="Number of processes rendering evidence files, 0 renders them inline. Default is the number of CPUs, 0 in batch mode", type=int, required=False)
+    parser.add_argument("--evidence-dir", help="Directory storing evidence files by content, can be shared between runs. Default is OUTPUT/code, or OUTPUT/evidence in batch mode", type=str, required=False)
+    parser.add_argument("--apk-dexofuzzy", help="Adds the dexofuzzy of the APK and of each of its dex files to the report", action='store_true')
+    parser.add_argument("--cache", help="Directory caching the analysis of APKs between runs", type=str, required=False)
+    parser.add_argument("--hash-cache", help="SQLite file caching the dexofuzzy hash of method bytecodes between runs and batch workers", type=str, required=False)
+    parser.add_argument("-t", "--triage", help="Reads the methods referenced by the dex files first, drops the rules which cannot match and skips the analysis of APKs no rule can match", action='store_true')
+    parser.add_argument("-x", "--xref-graph", help="Builds the call graph from the invoke instructions of the dex files instead of the androguard analysis, the methods quoted by findings are decompiled on demand", action='store_true')
+    parser.add_argument("--sparse-genom", help="Stores the genome as index:count pairs of the genes present, for rule packs with many predicates", action='store_true')
+    parser.add_argument("--corpus", help="Genome corpus directory the analyzed APKs are added to. With --apk, the samples most similar to the APK are printed first", type=str, required=False)
+    parser.add_argument("-k", "--top", help="Number of similar samples printed. Default is 10", type=int, default=10, required=False)
+    parser.add_argument("--metric", help="Genome similarity of the samples printed (jaccard, cosine, hamming). Default is jaccard", type=str, choices=['jaccard', 'cosine', 'hamming'], default='jaccard', required=False)
+    parser.add_argument("-j", "--jobs", help="Number of APKs analyzed in parallel in batch mode. Default is the number of CPUs", type=int, required=False)
+    parser.add_argument("--retry-failed", help="Analyzes again the APKs which failed in a previous batch run", action='store_true')
+    parser.add_argument("--timeout", help="Wall-clock limit of the analysis of each APK in batch mode, in seconds", type=float, required=False)
+    parser.add_argument("--max-memory", help="Address space limit of each worker in batch mode, in MB", type=int, required=False)
+    parser.add_argument("--max-nodes", help="Aborts the analysis of APKs whose call graph has more nodes", type=int, required=False)
     args = parser.parse_args()
 
-    if args.rules:
-        c = CFG(args.apk, args.output, args.rules. args.file)
-    else:
-        c = CFG(args.apk, args.output, args.file)
+    options = {
+        'output_file': args.file,
+        'rules_file': args.rules,
+        'compact_graph': args.compact,
+        'cache_dir': args.cache,
+        'hash_cache': args.hash_cache,
+        'max_nodes': args.max_nodes,
+        'rule_workers': args.rule_workers,
+        'graph_format': args.graph_format,
+        'render_processes': args.render_processes,
+        'evidence_dir': args.evidence_dir,
+        'evidence_processes': args.evidence_processes,
+        'lazy_evidence': args.lazy,
+        'apk_dexofuzzy': args.apk_dexofuzzy,
+        'sparse_genom': args.sparse_genom,
+        'triage': args.triage,
+        'xref_graph': args.xref_graph,
+    }
+    if args.evidence:
+        if not args.output:
+            parser.error('--evidence requires -o/--output')
+        try:
+            evidence_file = render_finding(args.output, args.evidence)
+        except (KeyError, FileNotFoundError):
+            parser.error(f'no finding {args.evidence} in {args.output}')
+        print(evidence_file)
+        return
+
+    if args.compile_rules:
+        RulePack.read(args.rules or RULES_FILE, list(CLUSTERS.keys())).save(args.compile_rules)
+        return
+
+    if args.similar:
+        if not args.corpus:
+            parser.error('--similar requires --corpus')
+        corpus = GenomCorpus(args.corpus)
+        row = corpus.digests.get(args.similar)
+        if row is None:
+            parser.error(f'no APK of sha256 {args.similar} in {args.corpus}')
+        similar = [(r, score) for r, score in corpus.query(corpus.get_matrix()[row], args.top + 1, args.metric) if r != row]
+        print_similar(corpus, similar[:args.top])
+        return
+
+    if not args.output:
+        parser.error('the following arguments are required: -o/--output')
+
+    if args.batch:
+        max_memory = args.max_memory * 1024 * 1024 if args.max_memory else None
+        batch = Batch(args.output, args.jobs, timeout=args.timeout, max_memory=max_memory,
+                      corpus_dir=args.corpus, **options)
+        batch.run(collect_apks(args.batch), retry_failed=args.retry_failed)
+        return
+
+    # A single APK renders its evidence and hashes its dex files in pools of processes, started from this guarded script
+    if options['evidence_processes'] is None:
+        options['evidence_processes'] = os.cpu_count()
+    options['dexofuzzy_processes'] = os.cpu_count()
+    c = CFG(args.apk, args.output, **options)
     c.compute_rules()
     c.generate_md_report()
+    if args.corpus:
+        corpus = GenomCorpus(args.corpus, c.genom.get_genes())
+        print_similar(corpus, corpus.query(c.genom.sequence, args.top, args.metric))
+        corpus.add(c.genom.sequence, {'apk': os.path.abspath(args.apk), 'sha256': file_sha256(args.apk),
+                                      'output_dir': os.path.abspath(args.output)})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,158 @@
+import json
+import os
+from hashlib import sha256
+from pathlib import Path
+
+import androguard
+import numpy as np
+
+from androcfg.compact_graph import CompactCallGraph
+
+CACHE_FORMAT = 2
+
+
+class MethodRef:
+    """
+    This class stands for an androguard method restored from the cache. It exposes the
+    naming API of EncodedMethod/ExternalMethod, the code is resolved on demand by CFG.
+    A class defined by several dex files has one androguard method per definition: copy
+    tells apart the nodes of the call graph sharing the same key.
+    """
+    __slots__ = ('class_name', 'name', 'descriptor', 'copy')
+
+    def __init__(self, class_name: str, name: str, descriptor: str, copy: int = 0):
+        self.class_name = class_name
+        self.name = name
+        self.descriptor = descriptor
+        self.copy = copy
+
+    def __eq__(self, other):
+        return isinstance(other, MethodRef) and self.key() == other.key() and self.copy == other.copy
+
+    def __hash__(self):
+        return hash((self.key(), self.copy))
+
+    def __repr__(self):
+        if self.copy:
+            return f'MethodRef({self.full_name} #{self.copy})'
+        return f'MethodRef({self.full_name})'
+
+    def key(self) -> tuple:
+        return self.class_name, self.name, self.descriptor
+
+    def get_method(self):
+        return self
+
+    def get_class_name(self) -> str:
+        return self.class_name
+
+    def get_name(self) -> str:
+        return self.name
+
+    def get_descriptor(self) -> str:
+        return self.descriptor
+
+    @property
+    def full_name(self) -> str:
+        return ' '.join([self.class_name, self.name, self.descriptor])
+
+
+def file_sha256(file_path: str) -> str:
+    digest = sha256()
+    with open(file_path, mode='rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _pack(obj) -> np.ndarray:
+    return np.frombuffer(json.dumps(obj).encode('utf-8'), dtype=np.uint8)
+
+
+def _unpack(array: np.ndarray):
+    return json.loads(array.tobytes().decode('utf-8'))
+
+
+class CachedAnalysis:
+    def __init__(self, call_graph: CompactCallGraph, index_order: list, class_hierarchy: dict, class_dex: dict):
+        self.call_graph = call_graph
+        self.index_order = index_order
+        self.class_hierarchy = class_hierarchy
+        self.class_dex = class_dex
+
+
+class AnalysisCache:
+    """
+    This class persists what CFG needs from an androguard Analysis: the call graph, the
+    order of the method index, the class hierarchy and the dex file defining each class. Entries are keyed by the SHA-256 of
+    the APK and the builder of the call graph, the androguard version by default.
+    """
+    def __init__(self, cache_dir: str, builder: str = None):
+        """
+        :param cache_dir: directory of the cache
+        :param builder: name and version of the call graph builder, if not androguard
+        """
+        self.cache_dir = cache_dir
+        self.builder = builder or f'androguard-{androguard.__version__}'
+        self.digests = {}
+
+    def apk_digest(self, apk_file: str) -> str:
+        if apk_file not in self.digests:
+            self.digests[apk_file] = file_sha256(apk_file)
+        return self.digests[apk_file]
+
+    def get_path(self, apk_file: str) -> str:
+        return f'{self.cache_dir}/{self.builder}/v{CACHE_FORMAT}/{self.apk_digest(apk_file)}.npz'
+
+    def load(self, apk_file: str):
+        """
+        :param apk_file: path of the APK
+        :return: the CachedAnalysis of the APK, None if it is not cached
+        """
+        path = self.get_path(apk_file)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            strings = _unpack(data['strings'])
+            nodes = []
+            copies = {}
+            for method in data['methods'].tolist():
+                # Nodes are saved in graph order, the nth node of a key is its nth copy
+                copy = copies[tuple(method)] = copies.get(tuple(method), -1) + 1
+                nodes.append(MethodRef(*[strings[s] for s in method], copy=copy))
+            call_graph = CompactCallGraph(nodes, data['sources'], data['targets'])
+            index_order = data['index_order'].tolist()
+            class_hierarchy = {k: (v[0], v[1]) for k, v in _unpack(data['hierarchy']).items()}
+            class_dex = _unpack(data['class_dex'])
+        return CachedAnalysis(call_graph, index_order, class_hierarchy, class_dex)
+
+    def save(self, apk_file: str, call_graph: CompactCallGraph, index_order: list, class_hierarchy: dict,
+             class_dex: dict = None):
+        """
+        :param apk_file: path of the APK
+        :param call_graph: call graph of the APK
+        :param index_order: node id of each method of the method index, in index order
+        :param class_hierarchy: (super class, interfaces) of each class
+        :param class_dex: name of the dex file defining each class, so that a restored analysis
+                          decompiles methods without analyzing the APK again
+        :return: path of the cache entry
+        """
+        strings = {}
+        methods = np.array([[strings.setdefault(s, len(strings)) for s in
+                             (m.class_name, m.name, str(m.get_descriptor()))] for m in call_graph.nodes],
+                           dtype=np.int32).reshape(-1, 3)
+        sources = np.repeat(np.arange(len(call_graph), dtype=np.int32), call_graph.out_degrees())
+        path = self.get_path(apk_file)
+        Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, mode='wb') as cache_file:
+            np.savez_compressed(cache_file,
+                                strings=_pack(list(strings)),
+                                methods=methods,
+                                sources=sources,
+                                targets=call_graph.successors_idx,
+                                index_order=np.array(index_order, dtype=np.int32),
+                                hierarchy=_pack(class_hierarchy),
+                                class_dex=_pack(class_dex or {}))
+        os.replace(tmp_path, path)
+        return path
@@ -0,0 +1,254 @@
+import glob
+import json
+import os
+import resource
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from hashlib import md5
+from pathlib import Path
+
+from androcfg.analysis_cache import file_sha256
+from androcfg.call_graph_extractor import CFG, get_genes
+from androcfg.genom import parse
+from androcfg.genom_corpus import GenomCorpus
+from androcfg.limits import AnalysisAborted, limit_memory, wall_clock_limit
+from androcfg.report import write_aborted_report
+
+# An APK is marked as failed once its worker process has crashed this many times while it ran alone
+MAX_ATTEMPTS = 2
+
+
+def collect_apks(source: str) -> list:
+    """
+    :param source: a directory, a file listing one APK path per line or a glob pattern
+    :return: the sorted absolute paths of the APKs
+    """
+    if os.path.isdir(source):
+        apks = [str(p) for p in Path(source).rglob('*.apk')]
+    elif os.path.isfile(source) and not source.endswith('.apk'):
+        with open(source) as list_file:
+            apks = [line.strip() for line in list_file if line.strip() and not line.startswith('#')]
+    else:
+        apks = glob.glob(source, recursive=True)
+    return sorted({os.path.abspath(apk) for apk in apks})
+
+
+def get_apk_output_dir(output_dir: str, apk_file: str) -> str:
+    h = md5(apk_file.encode('utf-8')).hexdigest()[:8]
+    return f'{output_dir}/{Path(apk_file).stem}_{h}'
+
+
+def analyze_apk(apk_file: str, output_dir: str, options: dict, timeout: float = None) -> dict:
+    """
+    Runs a whole CFG analysis, any error is reported in the returned record instead of being raised.
+    An analysis exceeding one of its limits is recorded as aborted, in the record and in report.json.
+    :param apk_file: path of the APK
+    :param output_dir: output directory of this APK
+    :param options: keyword arguments of CFG
+    :param timeout: wall-clock limit of the analysis in seconds
+    :return: the index record of the APK
+    """
+    record = {'apk': apk_file, 'output_dir': output_dir}
+    c = None
+    try:
+        with wall_clock_limit(timeout):
+            c = CFG(apk_file, output_dir, **options)
+            c.compute_rules()
+            c.generate_md_report()
+        record['status'] = 'done'
+        record['sha256'] = file_sha256(apk_file)
+        record['genom'] = c.genom.dumps()
+        record['rules'] = [rule_report['rule']['name'] for rule_report in c.report]
+        record['rule_pack'] = c.rule_pack.version
+        if c.triage is not None:
+            record['triage'] = c.triage
+        if c.dexofuzzy:
+            record['dexofuzzy'] = c.dexofuzzy['dexofuzzy']
+    except (AnalysisAborted, MemoryError) as e:
+        if isinstance(e, MemoryError):
+            e = AnalysisAborted('memory', resource.getrlimit(resource.RLIMIT_AS)[0], 'address space limit exceeded')
+        if c is not None:
+            c.abort()
+        c = None  # releases the analysis before writing the report
+        record['status'] = 'aborted'
+        record['aborted'] = e.to_dict()
+        write_aborted_report(output_dir, record['aborted'])
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = f'{type(e).__name__}: {e}'
+    return record
+
+
+class Batch:
+    """
+    This class analyzes many APKs with a pool of worker processes. Each finished APK is
+    appended to a checkpoint file so an interrupted batch resumes where it stopped.
+    """
+    def __init__(self, output_dir: str, jobs: int = None, timeout: float = None, max_memory: int = None,
+                 corpus_dir: str = None, **options):
+        self.output_dir = output_dir
+        self.corpus_dir = corpus_dir
+        self.jobs = jobs or os.cpu_count()
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.options = options
+        # Evidence shared by several APKs, e.g. a bundled SDK, is stored once for the whole batch
+        if not self.options.get('evidence_dir'):
+            self.options['evidence_dir'] = os.path.abspath(f'{output_dir}/evidence')
+        # APKs are already analyzed in parallel, their evidence is rendered by the workers themselves
+        if self.options.get('evidence_processes') is None:
+            self.options['evidence_processes'] = 0
+        # Nor are the dex files of each APK hashed in parallel
+        self.options['dexofuzzy_processes'] = 1
+        self.checkpoint_file = f'{output_dir}/checkpoint.jsonl'
+        self.index_file = f'{output_dir}/index.json'
+
+    def load_checkpoint(self) -> dict:
+        records = {}
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file) as checkpoint:
+                for line in checkpoint:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # last line of an interrupted run
+                    records[record['apk']] = record
+        return records
+
+    def _checkpoint(self, checkpoint, record: dict):
+        checkpoint.write(json.dumps(record) + '\n')
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+
+    def run(self, apks: list, retry_failed: bool = False) -> list:
+        """
+        :param apks: paths of the APKs to be analyzed
+        :param retry_failed: analyze again the APKs which failed in a previous run
+        :return: the index records of all the APKs
+        """
+        Path(self.output_dir).mkdir(parents=True, exist_ok=True)
+        records = self.load_checkpoint()
+        todo = [apk for apk in apks
+                if apk not in records or (retry_failed and records[apk]['status'] != 'done')]
+        attempts = {apk: 0 for apk in todo}
+
+        with open(self.checkpoint_file, mode='a') as checkpoint:
+            while todo:
+                crashed = self._run_pool(todo, records, checkpoint)
+                # The APKs running in a crashed pool are retried alone, only those crashing again are charged
+                while crashed:
+                    retried = []
+                    for apk in self._run_alone(crashed, records, checkpoint):
+                        attempts[apk] += 1
+                        if attempts[apk] < MAX_ATTEMPTS:
+                            retried.append(apk)
+                            continue
+                        record = {'apk': apk, 'output_dir': get_apk_output_dir(self.output_dir, apk),
+                                  'status': 'failed', 'error': 'worker process crashed'}
+                        self._record(apk, record, records, checkpoint)
+                    crashed = retried
+
+        index = [records[apk] for apk in apks if apk in records]
+        with open(self.index_file, mode='w') as index_file:
+            json.dump(index, index_file)
+        if self.corpus_dir:
+            self.update_corpus(index)
+        return index
+
+    def _submit(self, pool: ProcessPoolExecutor, apk: str):
+        return pool.submit(analyze_apk, apk, get_apk_output_dir(self.output_dir, apk), self.options, self.timeout)
+
+    def _record(self, apk: str, record: dict, records: dict, checkpoint):
+        records[apk] = record
+        self._checkpoint(checkpoint, record)
+
+    def _run_pool(self, todo: list, records: dict, checkpoint) -> list:
+        """
+        Analyzes the APKs of todo with a pool of jobs workers, until the pool breaks or todo is empty.
+        :param todo: APKs to be analyzed, those not submitted when the pool breaks are left in it
+        :param records: index records, updated with the records of the analyzed APKs
+        :param checkpoint: checkpoint file
+        :return: the APKs running when a worker process crashed
+        """
+        crashed = []
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=limit_memory,
+                                 initargs=(self.max_memory,)) as pool:
+            running = {}
+            broken = False
+            while running or (todo and not broken):
+                # Bound the in-flight tasks so a crashing worker only takes down a few APKs
+                while todo and not broken and len(running) < self.jobs:
+                    apk = todo.pop(0)
+                    try:
+                        future = self._submit(pool, apk)
+                    except BrokenProcessPool:
+                        todo.insert(0, apk)
+                        broken = True
+                        break
+                    running[future] = apk
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    apk = running.pop(future)
+                    try:
+                        record = future.result()
+                    except BrokenProcessPool:
+                        crashed.append(apk)
+                        broken = True
+                        continue
+                    self._record(apk, record, records, checkpoint)
+        return crashed
+
+    def _run_alone(self, apks: list, records: dict, checkpoint) -> list:
+        """
+        Analyzes each APK in a pool of a single worker, at most jobs of them at once, so that a
+        crash is only attributed to the APK which caused it.
+        :param apks: APKs to be analyzed
+        :param records: index records, updated with the records of the analyzed APKs
+        :param checkpoint: checkpoint file
+        :return: the APKs whose worker process crashed
+        """
+        crashed = []
+        pending = list(apks)
+        running = {}
+        try:
+            while pending or running:
+                while pending and len(running) < self.jobs:
+                    apk = pending.pop(0)
+                    pool = ProcessPoolExecutor(max_workers=1, initializer=limit_memory, initargs=(self.max_memory,))
+                    running[self._submit(pool, apk)] = apk, pool
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    apk, pool = running.pop(future)
+                    pool.shutdown()
+                    try:
+                        record = future.result()
+                    except BrokenProcessPool:
+                        crashed.append(apk)
+                        continue
+                    self._record(apk, record, records, checkpoint)
+        finally:
+            for _, pool in running.values():
+                pool.shutdown(cancel_futures=True)
+        return crashed
+
+    def update_corpus(self, records: list):
+        """
+        Adds the genomes of the analyzed APKs which are not in the corpus yet.
+        :param records: index records of the APKs
+        """
+        genes = get_genes(self.options.get('rules_file'))
+        corpus = GenomCorpus(self.corpus_dir, genes)
+        sequences = []
+        samples = []
+        for record in records:
+            if record['status'] != 'done':
+                continue
+            # Records checkpointed by older runs have no digest
+            digest = record.get('sha256') or file_sha256(record['apk'])
+            if corpus.contains(digest):
+                continue
+            sequences.append(parse(record['genom'], len(genes)))
+            samples.append({'apk': record['apk'], 'sha256': digest, 'output_dir': record['output_dir']})
+        corpus.add_many(sequences, samples)
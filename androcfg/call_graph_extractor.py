@@ -1,56 +1,130 @@
-import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import md5
 from pathlib import Path
 
 import networkx as nx
+from androguard.core.apk import APK
 from androguard.misc import AnalyzeAPK
 from graphviz import Digraph as dg
 from networkx import neighbors, reverse_view
-from PIL import Image, ImageDraw, ImageFont
-from pygments import highlight
-from pygments.formatters import HtmlFormatter, ImageFormatter, NullFormatter
-from pygments.lexers.jvm import JavaLexer
+from PIL import Image, ImageFont
 
-from androcfg.code_style import U39bStyle
+import androcfg.dekofuzzy as dekofuzzy
+from androcfg.analysis_cache import AnalysisCache, MethodRef
+from androcfg.compact_graph import CompactCallGraph
+from androcfg.evidence_renderer import LEGEND_FONT, EvidencePool, add_legend
+from androcfg.evidence_store import EvidenceStore
 from androcfg.genom import Genom
+from androcfg.graph_renderer import GraphRenderer
+from androcfg.hash_cache import HashCache
+from androcfg.limits import AnalysisAborted
+from androcfg.method_index import MethodIndex
+from androcfg.reachability import Reachability
+from androcfg.rule_pack import load_rule_pack
 from androcfg.report import MdReport
-import androcfg.dekofuzzy as dekofuzzy
+from androcfg.source_archive import SourceArchive
+from androcfg.source_cache import SourceCache
+from androcfg.triage import triage_apk
+from androcfg.xref_graph import XREF_GRAPH_VERSION, DexDecompiler, build_call_graph
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'rules.json')
+
+# Entrypoint clusters, by order of precedence, and the classes or interfaces they derive from
+CLUSTERS = {
+    'thread': ['java/lang/ThreadLocal', 'java/lang/Thread', 'java/lang/Runnable'],
+    'callable': ['java/util/concurrent/Callable'],
+    'fragment': ['androidx/fragment/app/Fragment'],
+    'webview_client': ['android/webkit/WebViewClient'],
+    'task': ['android/os/AsyncTask'],
+    'application': ['android/app/Application'],
+    'handler': ['android/os/Handler'],
+    'activity': ['android/app/Activity', 'androidx/appcompat/app/AppCompatActivity'],
+    'provider': ['android/view/accessibility/AccessibilityNodeProvider',
+                 'android/content/ContentProvider',
+                 'android/view/ViewOutlineProvider'],
+    'receiver': ['android/content/BroadcastReceiver'],
+    'service': ['android/app/Service'],
+    'intent_service': ['android/app/IntentService'],
+}
+
+
+def clean_name(node):
+    name = f"{str(node.class_name)}->{str(node.name)}()"
+    return name
+
+
+def get_genes(rules_file: str = None) -> list:
+    """
+    :param rules_file: JSON file containing rules, the default rule pack if None
+    :return: the (cluster, predicate) of each gene of the genomes built from the rules
+    """
+    return load_rule_pack(rules_file or RULES_FILE, list(CLUSTERS.keys())).genes
 
 
-def flatten(elements, flat_elements):
-    if isinstance(elements, dict):
-        for k, v in elements.items():
-            flat_elements.append(k)
-            flat_elements.extend(flatten(v, []))
-    elif isinstance(elements, list):
-        for elt in elements:
-            flat_elements.extend(flatten(elt, []))
-    elif isinstance(elements, str):
-        flat_elements.append(str(elements))
-    return flat_elements
+def get_package_name(name):
+    package = name[0:name.rfind('/')]
+    return '/'.join(package.split('/')[0:min(package.count('/'), 2)])
 
 
 class CFG:
-    def __init__(self, apk_file, output_dir, output_file, rules_file=None, save_graphs=True) -> object:
-        self.apk, self.dalvik_format_list, self.analysis = AnalyzeAPK(apk_file)
+    def __init__(self, apk_file, output_dir, output_file, rules_file=None, save_graphs=True,
+                 compact_graph=False, cache_dir=None, max_nodes=None, rule_workers=1,
+                 graph_format='png', render_processes=None, source_cache_size=64 * 1024 * 1024,
+                 evidence_dir=None, evidence_processes=0, lazy_evidence=False, apk_dexofuzzy=False,
+                 dexofuzzy_processes=1, hash_cache=None, sparse_genom=False, triage=False,
+                 xref_graph=False) -> object:
+        self.apk = None
+        self.dalvik_format_list = None
+        self.analysis = None
+        self.analysis_lock = threading.Lock()
+        # Set when the analysis is aborted, the rules still running stop at their next evidence
+        self.cancelled = threading.Event()
+        self.decompiler = None
         self.apk_file = apk_file
-        self.rules_file = rules_file
+        self.rules_file = rules_file or RULES_FILE
         self.output_dir = output_dir
-        if self.rules_file is None:
-            root = os.path.dirname(os.path.realpath(__file__))
-            self.rules_file = os.path.join(root, 'rules.json')
         self.cfg_output_dir = f'{output_dir}/cfg/'
         self.code_output_dir = f'{output_dir}/code/'
         self.report_output_dir = f'{output_dir}/'
         self.cluster_names = {}
+        self.class_clusters = {}
+        self.class_hierarchy = {}
+        self.method_index = None
         self.call_graph = None
         self.save_graphs = save_graphs
-        self._init_cluster_names()
+        self.compact_graph = compact_graph
+        self.max_nodes = max_nodes
+        self.rule_workers = rule_workers
+        self.graph_format = graph_format
+        self.renderer = GraphRenderer(render_processes, image_format=graph_format)
+        self.hash_cache = HashCache(hash_cache) if hash_cache else None
+        self.sources = SourceCache(source_cache_size, self.hash_cache)
+        self.evidence_pool = EvidencePool(evidence_processes)
+        self.evidence_store = EvidenceStore(evidence_dir or self.code_output_dir.rstrip('/'))
+        self.source_archive = SourceArchive(output_dir) if lazy_evidence else None
+        self.apk_dexofuzzy = apk_dexofuzzy
+        self.dexofuzzy_processes = dexofuzzy_processes
+        self.dexofuzzy = None
+        self.xref_graph = xref_graph
+        # Both builders give different graphs for the same APK, each has its own cache entries
+        builder = f'xref-{XREF_GRAPH_VERSION}' if xref_graph else None
+        self.cache = AnalysisCache(cache_dir, builder) if cache_dir else None
+        self.triage = None
         self._init_rules()
+        if triage:
+            self._triage()
+        if self.rules:
+            self._init_analysis()
+        else:
+            # No rule can match, only the manifest is read for the report
+            self.apk = APK(self.apk_file)
+        self._init_cluster_names()
         self._init_output_dirs()
         self.report = []
-        self.genom = Genom(self.rules_file, list(self.cluster_names.keys()))
+        self.genom = Genom(self.rules_file, list(self.cluster_names.keys()), sparse=sparse_genom,
+                           rule_pack=self.rule_pack)
         self.output_file = output_file
 
     def _init_output_dirs(self):
@@ -59,91 +133,154 @@ class CFG:
         Path(self.code_output_dir).mkdir(parents=True, exist_ok=True)
 
     def _init_rules(self):
-        with open(self.rules_file) as rf:
-            self.rules = json.load(rf)
+        # Compiled once per process, a batch worker reuses it for every APK
+        self.rule_pack = load_rule_pack(self.rules_file, list(CLUSTERS.keys()))
+        self.rules = self.rule_pack.rules
+
+    def _triage(self):
+        """
+        Drops the rules none of whose predicates matches a method defined or referenced by the dex files.
+        """
+        try:
+            rules = triage_apk(self.apk_file, self.rule_pack)
+        except Exception:
+            return  # dex files the triage cannot read are analyzed in full
+        self.rules = [self.rules[i] for i in rules]
+        self.triage = [rule['name'] for rule in self.rules]
+
+    def _init_analysis(self):
+        cached = self.cache.load(self.apk_file) if self.cache else None
+        if cached:
+            self.apk = APK(self.apk_file)
+            self.call_graph = cached.call_graph
+            self._check_call_graph_size()
+            self.method_index = MethodIndex()
+            for i in cached.index_order:
+                m = self.call_graph.nodes[i]
+                self.method_index.add_class(m.class_name, [(m.name, m)])
+            self.class_hierarchy = cached.class_hierarchy
+            if cached.class_dex:
+                # Methods quoted by findings are decompiled from their dex file, the APK is not analyzed
+                self.decompiler = DexDecompiler(self.apk, cached.class_dex)
+            return
+
+        if self.xref_graph:
+            # Only the invoke instructions are decoded, methods are decompiled when a finding quotes them
+            self.apk = APK(self.apk_file)
+            self.call_graph, self.method_index, self.class_hierarchy, class_dex = \
+                build_call_graph(self.apk_file, list(self.apk.get_dex_names()))
+            self._check_call_graph_size()
+            self.decompiler = DexDecompiler(self.apk, class_dex)
+        else:
+            self._load_analysis()
+            self.method_index = MethodIndex(self.analysis)
+            self.class_hierarchy = {clazz.name: (clazz.extends, list(clazz.implements))
+                                    for clazz in self.analysis.get_classes()}
+            # The last definition of a class defined by several dex files is the one the analysis keeps
+            class_dex = {}
+            for dex_name, dex in zip(self.apk.get_dex_names(), self.dalvik_format_list):
+                for clazz in dex.get_classes():
+                    class_dex[clazz.get_name()] = dex_name
+        if self.cache:
+            if self.call_graph is None:
+                self.compute_apk_call_graph()
+            call_graph = self.call_graph
+            if not isinstance(call_graph, CompactCallGraph):
+                call_graph = CompactCallGraph.from_networkx(call_graph)
+            index_order = [call_graph.ids[m.get_method()] for m in self.method_index]
+            self.cache.save(self.apk_file, call_graph, index_order, self.class_hierarchy, class_dex)
+
+    def _load_analysis(self):
+        # Rule workers resolving methods of a graph built without the analysis share a single one
+        with self.analysis_lock:
+            if self.analysis is None:
+                self.apk, self.dalvik_format_list, self.analysis = AnalyzeAPK(self.apk_file)
+
+    def _resolve_method(self, method):
+        """
+        :param method: a node of the call graph
+        :return: the androguard method of the node, only parsing its dex file if the call graph was
+                 restored from the cache or built from the invoke instructions
+        """
+        if isinstance(method, MethodRef):
+            if self.decompiler:
+                resolved = self.decompiler.get_method(method)
+                if resolved is not None:
+                    return resolved
+            self._load_analysis()
+            return self.analysis.get_method_analysis_by_name(*method.key()).get_method()
+        return method
 
     def _init_cluster_names(self):
-        self.cluster_names = {
-            'thread': self._get_sub_classes(['java/lang/ThreadLocal', 'java/lang/Thread']) +
-                      self._get_impl_of('Ljava/lang/Runnable;'),
-            'callable': self._get_impl_of('Ljava/util/concurrent/Callable;'),
-            'fragment': self._get_sub_classes(['androidx/fragment/app/Fragment']),
-            'webview_client': self._get_sub_classes(['android/webkit/WebViewClient']),
-            'task': self._get_sub_classes(['android/os/AsyncTask']),
-            'application': self._get_sub_classes(['android/app/Application']),
-            'handler': self._get_sub_classes(['android/os/Handler']),
-            'activity': self._get_sub_classes(['android/app/Activity',
-                                               'androidx/appcompat/app/AppCompatActivity']),
-            'provider': self._get_sub_classes(
-                ['android/view/accessibility/AccessibilityNodeProvider',
-                 'android/content/ContentProvider',
-                 'android/view/ViewOutlineProvider']),
-            'receiver': self._get_sub_classes(['android/content/BroadcastReceiver']),
-            'service': self._get_sub_classes(['android/app/Service']),
-            'intent_service': self._get_sub_classes(['android/app/IntentService']),
-        }
-
-    def _get_impl_of(self, interface):
-        implementations = []
-        for clazz in self.analysis.get_classes():
-            if interface in clazz.implements:
-                implementations.append(clazz.name[1:-1])
-        return implementations
-
-    def _get_sub_classes(self, super_class_name):
-        scn = super_class_name
-        sub_classes = []
-        if isinstance(super_class_name, str):
-            scn = [super_class_name]
-        for dalvik in self.dalvik_format_list:
-            hierarchy = dalvik.list_classes_hierarchy()['Root']
-            for elt in hierarchy:
-                if list(elt)[0] in scn:
-                    sub_classes.extend(flatten(elt, []))
-        return sub_classes
+        """
+        Walks the class hierarchy of the whole APK once, across every dex, and maps each class
+        to the first cluster one of its super classes, or one of the interfaces it implements
+        directly, belongs to: the subclasses of a Runnable are not threads.
+        """
+        priorities = {}
+        for priority, bases in enumerate(CLUSTERS.values()):
+            for base in bases:
+                priorities.setdefault(f'L{base};', priority)
+
+        resolved = {}
+        unknown = len(CLUSTERS)
+
+        def resolve(name):
+            # Priority of the super class chain only
+            if name in resolved:
+                return resolved[name]
+            resolved[name] = unknown  # guards against malformed cyclic hierarchies
+            priority = priorities.get(name, unknown)
+            if name in self.class_hierarchy:
+                priority = min(priority, resolve(self.class_hierarchy[name][0]))
+            resolved[name] = priority
+            return priority
+
+        names = list(CLUSTERS.keys())
+        self.cluster_names = {cluster: [] for cluster in names}
+        self.class_clusters = {}
+        for name, (_, implements) in self.class_hierarchy.items():
+            priority = min([resolve(name)] + [priorities.get(interface, unknown) for interface in implements])
+            if priority != unknown:
+                self.cluster_names[names[priority]].append(name[1:-1])
+                self.class_clusters[name[1:-1]] = names[priority]
 
     def get_cluster_name(self, class_name):
-        for cluster, classes in self.cluster_names.items():
-            if class_name in classes:
-                return cluster
-        return 'unknown'
+        return self.class_clusters.get(class_name, 'unknown')
+
+    @staticmethod
+    def append_legend(image_file, text, font_size=10):
+        with Image.open(image_file) as image:
+            image = add_legend(image, text, ImageFont.truetype(LEGEND_FONT, font_size))
+        image.save(image_file)
+
+    def compute_apk_dexofuzzy(self) -> dict:
+        if self.dexofuzzy is None and self.dalvik_format_list is not None:
+            # Reuses the dex files parsed by androguard, in the order AnalyzeAPK loaded them
+            dex_objects = dict(zip(self.apk.get_dex_names(), self.dalvik_format_list))
+            self.dexofuzzy = dekofuzzy.hash_dex_objects(dex_objects)
+        elif self.dexofuzzy is None:
+            self.dexofuzzy = dekofuzzy.hash_apk(self.apk_file, max_workers=self.dexofuzzy_processes)
+        return self.dexofuzzy
 
     def generate_json_report(self) -> dict:
         ctx = {
             'genom': self.genom.dumps(),
             'rules': self.report
         }
+        if self.apk_dexofuzzy:
+            ctx['dexofuzzy'] = self.compute_apk_dexofuzzy()
 
         return ctx
 
-    @staticmethod
-    def append_legend(image_file, text, font_size=10):
-        def add_margin(pil_img, top, right, bottom, left, color):
-            width, height = pil_img.size
-            new_width = width + right + left
-            new_height = height + top + bottom
-            result = Image.new(pil_img.mode, (new_width, new_height), color)
-            result.paste(pil_img, (left, top))
-            return result
-
-        original = Image.open(image_file)
-        bottom_margin = 30
-        new = add_margin(original, 0, 0, bottom_margin, 0, (89, 49, 150))
-        image_height = new.height
-        root = os.path.dirname(os.path.realpath(__file__))
-        font_file = os.path.join(root, 'fonts/OpenSans-Regular.ttf')
-        font = ImageFont.truetype(font_file, font_size)
-        text_width, text_height = font.getsize(text)
-        text_left = 10
-        text_top = image_height - bottom_margin / 2 - text_height / 2
-        draw = ImageDraw.Draw(new)
-        draw.text((text_left, text_top), text, font=font)
-        new.save(image_file)
-
     def trace_back_method(self, class_name, method_name, root_node):
         trace_back = nx.DiGraph()
-        for m in self.analysis.find_methods(methodname=method_name, classname=class_name):
-            ancestors = nx.ancestors(self.call_graph, m)
+        for m in self.method_index.find(class_name, method_name):
+            m = m.get_method()
+            if isinstance(self.call_graph, CompactCallGraph):
+                ancestors = self.call_graph.ancestors(m)
+            else:
+                ancestors = nx.ancestors(self.call_graph, m)
             ancestors.add(m)
             graph = self.call_graph.subgraph(ancestors)
             trace_back.add_edges_from(graph.edges())
@@ -151,202 +288,233 @@ class CFG:
         return trace_back
 
     def compute_apk_call_graph(self):
-        self.call_graph = self.analysis.get_call_graph()
+        self._load_analysis()
+        call_graph = self.analysis.get_call_graph()
+        if self.compact_graph:
+            call_graph = CompactCallGraph.from_networkx(call_graph)
+        self.call_graph = call_graph
+        self._check_call_graph_size()
+
+    def _check_call_graph_size(self):
+        if self.max_nodes and len(self.call_graph) > self.max_nodes:
+            raise AnalysisAborted('max_nodes', self.max_nodes,
+                                  f'call graph has {len(self.call_graph)} nodes, limit is {self.max_nodes}')
 
     def generate_md_report(self):
-        report = MdReport(self.report, self.apk)
+        self.renderer.join()
+        self.evidence_pool.join()
+        if self.hash_cache:
+            self.hash_cache.flush()
+        if self.source_archive:
+            self.source_archive.close(self.output_file, self.evidence_store.store_dir)
+        dexofuzzy = self.compute_apk_dexofuzzy() if self.apk_dexofuzzy else None
+        report = MdReport(self.report, self.apk, dexofuzzy)
         report.generate(self.report_output_dir)
         return self.report
 
+    def abort(self):
+        """
+        Stops the rules still running and the rendering of the graphs and of the evidence.
+        """
+        self.cancelled.set()
+        self.renderer.terminate()
+        self.evidence_pool.terminate()
+
     def compute_rules(self):
+        if not self.rules:
+            return
         if not self.call_graph:
             self.compute_apk_call_graph()
 
-        def clean_name(node):
-            name = f"{str(node.class_name)}->{str(node.name)}()"
-            return name
-
-        def get_package_name(name):
-            package = name[0:name.rfind('/')]
-            return '/'.join(package.split('/')[0:min(package.count('/'), 2)])
-
-        for rule in self.rules:
-            rule_report = {
-                'rule': rule,
-                'findings': [],
-                'cfg_file': None
-            }
-            rule_report['rule']['title'] = rule_report['rule']['title'][:-1]
-
-            fg = dg(engine='dot',
-                    format='png',
-                    graph_attr={'overlap': 'orthoxy',
-                                'diredgeconstraints': 'true',
-                                'splines': 'ortho'},
-                    edge_attr={'color': '#593196', },
-                    node_attr={'shape': 'box',
-                               'style': 'filled',
-                               'color': '#ece5f6',
-                               'fontcolor': '#593196',
-                               'fontsize': '10',
-                               'fontname': 'sans-serif'})
-
-            entire_call_graph = nx.DiGraph()
-            contracted_call_graph = nx.DiGraph()
-
-            # Init the clusters
-            clusters = {'unknown': []}
-            for c, _ in self.cluster_names.items():
-                clusters[c] = []
-
-            # Find matching API methods
-            methods = []
-            for search in rule['or_predicates']:
-                class_name = '/'.join(search.split('/')[:-1])
-                method_name = search.split('/')[-1]
-                for m in self.analysis.find_methods(methodname=method_name, classname=class_name):
-                    m = m.get_method()
-                    methods.append(m)
-                    # Build CFG
-                    fg.node(clean_name(m), color='#593196', fontcolor='white')
-                    ancestors = nx.ancestors(self.call_graph, m)
-                    ancestors.add(m)
-                    graph = self.call_graph.subgraph(ancestors)
-                    entire_call_graph.add_edges_from(graph.edges())
-                    for n, d in graph.in_degree():
-                        if d == 0:
-                            class_name = n.get_class_name()
-                            cluster_name = self.get_cluster_name(class_name[1:-1])
-                            self.genom.add_gene(cluster_name, search)
-
-            rule_name = rule['name']
-
-            # Extract method source code
-            if self.save_graphs:
-                for n, d in entire_call_graph.out_degree():
-                    if d == 0:
-                        for parent in neighbors(reverse_view(entire_call_graph), n):
-                            try:
-                                bytecode = b''
-                                
-                                if parent.get_code():
-                                    bytecode = bytes(parent.get_code().get_raw())
-
-                                dexofuzzy_hash = dekofuzzy.hash(bytecode)
-
-                                java_code = parent.get_source()
-                                class_name = parent.get_class_name()
-                                hash = md5()
-                                hash.update(parent.full_name.encode('utf-8'))
-                                h = hash.hexdigest()
-                                filename = f'code_{rule_name}_{class_name}_{h}.{self.output_file}'.replace('/', '-').replace(' ', '_').replace(';','-')
-                                file_path = f'{self.code_output_dir}/{filename}'
-                                rule_report['findings'].append({
-                                    'id': h,
-                                    'call_by': str(class_name)[1:-1],
-                                    'evidence_file': os.path.relpath(file_path, start=self.report_output_dir),
-                                    'dexofuzzy_hash': dexofuzzy_hash
-                                })
-                                if self.output_file == "html":
-                                    with open(file_path, mode='wb') as out:
-
-                                        result = highlight(java_code,
-                                                        JavaLexer(), HtmlFormatter())
-                                        out.write(result.encode())
-                                    
-                                elif self.output_file == "raw":
-                                    with open(file_path, mode='wb') as out:
-                                        result = highlight(java_code,
-                                                JavaLexer(), NullFormatter())
-                                        out.write(result.encode())
-                                else:
-                                    with open(file_path, mode='wb') as out:
-
-                                        result = highlight(java_code,
-                                                       JavaLexer(),
-                                                       ImageFormatter(style=U39bStyle,
-                                                                      image_format='BMP',
-                                                                      font_name='DejaVu Sans Mono',
-                                                                      line_pad=4,
-                                                                      font_size=12,
-                                                                      line_number_bg='#A991D4',
-                                                                      line_number_fg='#ffffff'))
-                                        out.write(result)
-                                
-                                try:
-                                    CFG.append_legend(f'{self.code_output_dir}/{filename}', str(class_name), 12)
-                                except Exception:
-                                    pass
-
-                            except Exception:
-                                pass
-
-            # List nodes to be traced back - compute the clusters
-            for n, d in entire_call_graph.in_degree():
-                if d == 0:
+        # Resolve every predicate once and label the whole call graph in a single pass
+        predicates = {search for rule in self.rules for search in rule['or_predicates']}
+        matches = {}
+        for search in self.rule_pack.predicates:
+            if search not in predicates:
+                continue
+            class_name, method_name = self.rule_pack.keys[search]
+            matches[search] = [m.get_method() for m in self.method_index.find(class_name, method_name)]
+        targets = [m for methods in matches.values() for m in methods]
+        reachability = Reachability(self.call_graph, targets)
+
+        def compute(rule):
+            return self._compute_rule(rule, matches, reachability)
+
+        if self.rule_workers > 1:
+            # Rules only read the call graph; rendering and graphviz run concurrently
+            pool = ThreadPoolExecutor(max_workers=self.rule_workers)
+            try:
+                results = list(pool.map(compute, self.rules))
+            except BaseException:
+                # A limit raised while waiting stops the running rules, none is left writing after the abort
+                self.cancelled.set()
+                raise
+            finally:
+                pool.shutdown(wait=True, cancel_futures=True)
+        else:
+            results = map(compute, self.rules)
+
+        # Merge in rule order so that the report and the genome do not depend on scheduling
+        for rule_report, genes in results:
+            for cluster_name, search in genes:
+                self.genom.add_gene(cluster_name, search)
+            if rule_report:
+                self.report.append(rule_report)
+
+    def _compute_rule(self, rule, matches, reachability):
+        if self.cancelled.is_set():
+            return None, []
+        rule_report = {
+            # The rules are shared by the APKs analyzed by this process
+            'rule': dict(rule),
+            'findings': [],
+            'cfg_file': None
+        }
+        rule_report['rule']['title'] = rule_report['rule']['title'][:-1]
+
+        fg = dg(engine='dot',
+                format='png',
+                graph_attr={'overlap': 'orthoxy',
+                            'diredgeconstraints': 'true',
+                            'splines': 'ortho'},
+                edge_attr={'color': '#593196', },
+                node_attr={'shape': 'box',
+                           'style': 'filled',
+                           'color': '#ece5f6',
+                           'fontcolor': '#593196',
+                           'fontsize': '10',
+                           'fontname': 'sans-serif'})
+
+        contracted_call_graph = nx.DiGraph()
+
+        # Init the clusters
+        clusters = {'unknown': []}
+        for c, _ in self.cluster_names.items():
+            clusters[c] = []
+
+        # Find matching API methods
+        genes = []
+        methods = []
+        for search in rule['or_predicates']:
+            for m in matches[search]:
+                methods.append(m)
+                # Build CFG
+                fg.node(clean_name(m), color='#593196', fontcolor='white')
+                for n in reachability.roots(m):
                     class_name = n.get_class_name()
                     cluster_name = self.get_cluster_name(class_name[1:-1])
-                    clusters[cluster_name].append(n)
-
-            roots = []
-            leaves = []
+                    genes.append((cluster_name, search))
+        entire_call_graph = reachability.subgraph(methods)
 
-            # Contract CFG
-            for n, d in entire_call_graph.in_degree():
+        # Extract method source code, identical evidence is stored once
+        if self.save_graphs:
+            for n, d in entire_call_graph.out_degree():
                 if d == 0:
-                    u = clean_name(n)
-                    roots.append(u)
-                elif n in methods:
-                    u = clean_name(n)
-                    leaves.append(u)
-
-            for u, v in entire_call_graph.edges():
-                _u = get_package_name(clean_name(u))
-                if clean_name(u) in roots:
-                    _u = clean_name(u)
-                _v = get_package_name(clean_name(v))
-                if clean_name(v) in leaves:
-                    _v = clean_name(v)
-                contracted_call_graph.add_edge(_u, _v)
-
-            # Create graph clusters
-            with fg.subgraph(name=f'cluster_entrypoints') as entry:
-                entry.attr(label=f'Entrypoints')
-                entry.attr(shape='box')
-                entry.attr(color='#593196')
-                entry.attr(fontcolor='#593196')
-                entry.attr(fontsize='14')
-                entry.attr(margin='6')
-                entry.attr(fontname='sans-serif')
-                entry.attr(labeljust='l')
-                for k, v in clusters.items():
-                    if v:
-                        with entry.subgraph(name=f'cluster_{k}') as c:
-                            name = k.replace('_', ' ').title()
-                            c.attr(label=f'{name}')
-                            c.attr(color='#ece5f6')
-                            c.attr(style='filled')
-                            c.attr(margin='5')
-                            c.attr(fontcolor='#593196')
-                            c.attr(fontsize='12')
-                            c.attr(fontname='sans-serif')
-                            c.attr(labeljust='l')
-                            for n in v:
-                                c.node(clean_name(n), color='#a991d4', fontcolor='white')
-
-            # Create graphviz graph
-            for u, v in contracted_call_graph.edges():
-                if u != v:
-                    fg.edge(u, v, constraint='true')
-
-            with fg.subgraph(name=f'cluster_other_entrypoints') as others:
-                for n in clusters['unknown']:
-                    others.node(clean_name(n), color='#a991d4', fontcolor='white')
-
-            if len(contracted_call_graph.nodes()) > 1 and self.save_graphs:
-                graph_name = rule['name']
-                path = f'{self.cfg_output_dir}/{graph_name}'
-                fg.render(path)
-                rule_report['cfg_file'] = os.path.relpath(path, self.report_output_dir)
-                self.report.append(rule_report)
+                    for parent in neighbors(reverse_view(entire_call_graph), n):
+                        if self.cancelled.is_set():
+                            return None, []
+                        try:
+                            parent = self._resolve_method(parent)
+                            # Callers shared by several rules are decompiled once per APK
+                            method_source = self.sources.get(parent)
+                            dexofuzzy_hash = method_source.dexofuzzy_hash
+                            java_code = method_source.source
+                            class_name = parent.get_class_name()
+                            hash = md5()
+                            hash.update(parent.full_name.encode('utf-8'))
+                            h = hash.hexdigest()
+                            legend = str(class_name)
+                            evidence_digest = EvidenceStore.digest(java_code, self.output_file, legend)
+                            file_path = self.evidence_store.get_path(evidence_digest, self.output_file)
+                            rule_report['findings'].append({
+                                'id': h,
+                                'call_by': str(class_name)[1:-1],
+                                'evidence_file': os.path.relpath(file_path, start=self.report_output_dir),
+                                'evidence_digest': evidence_digest,
+                                'dexofuzzy_hash': dexofuzzy_hash
+                            })
+                            if self.source_archive:
+                                # Rendered on demand, see render_finding
+                                self.source_archive.add(h, java_code, legend)
+                                continue
+                            evidence_path = self.evidence_store.claim(evidence_digest, self.output_file)
+                            if evidence_path:
+                                self.evidence_pool.submit(self.output_file, java_code, legend, evidence_path)
+                        except Exception:
+                            pass
+
+        # List nodes to be traced back - compute the clusters
+        for n, d in entire_call_graph.in_degree():
+            if d == 0:
+                class_name = n.get_class_name()
+                cluster_name = self.get_cluster_name(class_name[1:-1])
+                clusters[cluster_name].append(n)
+
+        roots = []
+        leaves = []
+
+        # Contract CFG
+        for n, d in entire_call_graph.in_degree():
+            if d == 0:
+                u = clean_name(n)
+                roots.append(u)
+            elif n in methods:
+                u = clean_name(n)
+                leaves.append(u)
+
+        for u, v in entire_call_graph.edges():
+            _u = get_package_name(clean_name(u))
+            if clean_name(u) in roots:
+                _u = clean_name(u)
+            _v = get_package_name(clean_name(v))
+            if clean_name(v) in leaves:
+                _v = clean_name(v)
+            contracted_call_graph.add_edge(_u, _v)
+
+        # Create graph clusters
+        with fg.subgraph(name=f'cluster_entrypoints') as entry:
+            entry.attr(label=f'Entrypoints')
+            entry.attr(shape='box')
+            entry.attr(color='#593196')
+            entry.attr(fontcolor='#593196')
+            entry.attr(fontsize='14')
+            entry.attr(margin='6')
+            entry.attr(fontname='sans-serif')
+            entry.attr(labeljust='l')
+            for k, v in clusters.items():
+                if v:
+                    with entry.subgraph(name=f'cluster_{k}') as c:
+                        name = k.replace('_', ' ').title()
+                        c.attr(label=f'{name}')
+                        c.attr(color='#ece5f6')
+                        c.attr(style='filled')
+                        c.attr(margin='5')
+                        c.attr(fontcolor='#593196')
+                        c.attr(fontsize='12')
+                        c.attr(fontname='sans-serif')
+                        c.attr(labeljust='l')
+                        for n in v:
+                            c.node(clean_name(n), color='#a991d4', fontcolor='white')
+
+        # Create graphviz graph
+        for u, v in contracted_call_graph.edges():
+            if u != v:
+                fg.edge(u, v, constraint='true')
+
+        with fg.subgraph(name=f'cluster_other_entrypoints') as others:
+            for n in clusters['unknown']:
+                others.node(clean_name(n), color='#a991d4', fontcolor='white')
+
+        if self.cancelled.is_set():
+            return None, []
+        if len(contracted_call_graph.nodes()) > 1 and self.save_graphs:
+            graph_name = rule['name']
+            path = f'{self.cfg_output_dir}/{graph_name}'
+            # Only the DOT file is written here, the layout runs in the background
+            fg.save(path)
+            if self.graph_format != 'dot':
+                self.renderer.submit(path)
+            rule_report['cfg_file'] = os.path.relpath(path, self.report_output_dir)
+            return rule_report, genes
+        return None, genes
 
@@ -0,0 +1,105 @@
+import networkx as nx
+import numpy as np
+
+
+def _csr(size: int, sources: np.ndarray, targets: np.ndarray):
+    order = np.argsort(sources, kind='stable')
+    pointers = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=size), out=pointers[1:])
+    return pointers, targets[order].astype(np.int32)
+
+
+def _gather(pointers: np.ndarray, indices: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    starts = pointers[ids]
+    lengths = pointers[ids + 1] - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype=indices.dtype)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return indices[offsets + np.arange(total)]
+
+
+class CompactCallGraph:
+    """
+    This class stores a call graph with methods interned to integer ids and both the forward
+    and the reverse adjacency kept as CSR arrays. Queries taking or returning methods mirror
+    the networkx ones used on the call graph returned by androguard.
+    """
+    def __init__(self, nodes: list, sources: np.ndarray, targets: np.ndarray):
+        self.nodes = nodes
+        self.ids = {n: i for i, n in enumerate(nodes)}
+        size = len(nodes)
+        sources = np.asarray(sources, dtype=np.int32)
+        targets = np.asarray(targets, dtype=np.int32)
+        self.successors_ptr, self.successors_idx = _csr(size, sources, targets)
+        self.predecessors_ptr, self.predecessors_idx = _csr(size, targets, sources)
+
+    @classmethod
+    def from_networkx(cls, graph: nx.DiGraph):
+        nodes = list(graph.nodes())
+        ids = {n: i for i, n in enumerate(nodes)}
+        count = graph.number_of_edges()
+        sources = np.fromiter((ids[u] for u, _ in graph.edges()), dtype=np.int32, count=count)
+        targets = np.fromiter((ids[v] for _, v in graph.edges()), dtype=np.int32, count=count)
+        return cls(nodes, sources, targets)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def number_of_edges(self) -> int:
+        return len(self.successors_idx)
+
+    def successor_ids(self, i: int) -> np.ndarray:
+        return self.successors_idx[self.successors_ptr[i]:self.successors_ptr[i + 1]]
+
+    def predecessor_ids(self, i: int) -> np.ndarray:
+        return self.predecessors_idx[self.predecessors_ptr[i]:self.predecessors_ptr[i + 1]]
+
+    def in_degrees(self) -> np.ndarray:
+        return np.diff(self.predecessors_ptr)
+
+    def out_degrees(self) -> np.ndarray:
+        return np.diff(self.successors_ptr)
+
+    def ancestor_ids(self, ids) -> np.ndarray:
+        """
+        :param ids: node ids
+        :return: the sorted ids of every node from which one of the given nodes is reachable
+        """
+        seen = np.zeros(len(self.nodes), dtype=bool)
+        frontier = np.unique(np.asarray(ids, dtype=np.int32))
+        while len(frontier):
+            parents = _gather(self.predecessors_ptr, self.predecessors_idx, frontier)
+            parents = np.unique(parents[~seen[parents]])
+            seen[parents] = True
+            frontier = parents
+        return np.flatnonzero(seen)
+
+    def subgraph_edges(self, ids):
+        """
+        :param ids: node ids
+        :return: (sources, targets) arrays of the edges between the given nodes
+        """
+        selected = np.zeros(len(self.nodes), dtype=bool)
+        selected[np.asarray(ids, dtype=np.int32)] = True
+        sources = np.repeat(np.arange(len(self.nodes), dtype=np.int32), self.out_degrees())
+        keep = selected[sources] & selected[self.successors_idx]
+        return sources[keep], self.successors_idx[keep]
+
+    def ancestors(self, node) -> set:
+        source = self.ids[node]
+        return {self.nodes[i] for i in self.ancestor_ids([source]).tolist() if i != source}
+
+    def subgraph(self, nodes) -> nx.DiGraph:
+        graph = nx.DiGraph()
+        ids = [self.ids[n] for n in nodes]
+        graph.add_nodes_from(self.nodes[i] for i in sorted(ids))
+        sources, targets = self.subgraph_edges(ids)
+        graph.add_edges_from((self.nodes[u], self.nodes[v]) for u, v in zip(sources.tolist(), targets.tolist()))
+        return graph
+
+    def in_degree(self):
+        return zip(self.nodes, self.in_degrees().tolist())
+
+    def out_degree(self):
+        return zip(self.nodes, self.out_degrees().tolist())
@@ -19,9 +19,20 @@
 """
 
 import ctypes
+import mmap
+import multiprocessing
+import os
+import re
 import struct
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+
 import ssdeep
 
+from androcfg.dex_tables import DexTables, decode_uleb128
+
 
 def hash(dex_data):
     """
@@ -30,19 +41,168 @@ def hash(dex_data):
     :return: The dexofuzzy of the dex binary data
     """
 
+    return DexofuzzyResult(extract_bytecode(dex_data)).hash()
+
+
+def extract_bytecode(dex_data):
+    """
+    This function extracts the opcodes of a dex binary data, as hash does.
+    :param dex_data: bytes
+    :return: The opcode list of the dex binary data
+    """
+
     if not isinstance(dex_data, bytes):
         raise TypeError("must be of bytes type")
 
-    generate_dexoFuzzy = ExtractOpcode()
+    generate_dexoFuzzy = FastExtractOpcode()
     generate_dexoFuzzy.dex = dex_data
     generate_dexoFuzzy.get_bytecode(0, len(dex_data))
-    feature = ""
-    for opcodes in generate_dexoFuzzy.opcodes_in_method:
-        feature += ssdeep.hash(opcodes, encoding="UTF-8").split(":")[1]
 
-        dexofuzzy = ssdeep.hash(feature, encoding="UTF-8")
+    return generate_dexoFuzzy.opcodes_in_method
+
+
+def get_dex_names(apk_file):
+    """
+    :param apk_file: path of the APK
+    :return: the names of the classes*.dex files of the APK, in multidex order
+    """
+    with zipfile.ZipFile(apk_file) as apk:
+        names = [name for name in apk.namelist() if re.fullmatch(r"classes\d*\.dex", name)]
+    return sorted(names, key=_multidex_order)
+
+
+def _multidex_order(name):
+    return int(name[7:-4] or 1)
+
+
+@contextmanager
+def open_dex(apk_file, name):
+    """
+    Yields the data of a dex file of the APK. A dex stored uncompressed is not read: a
+    memoryview of the memory-mapped APK is yielded instead.
+    :param apk_file: path of the APK
+    :param name: name of the dex file in the APK
+    """
+    with zipfile.ZipFile(apk_file) as apk:
+        info = apk.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED:
+            yield apk.read(name)
+            return
+
+    with open(apk_file, mode="rb") as apk:
+        mapped = mmap.mmap(apk.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        # The data follows the 30 bytes of the local file header, the name and the extra field
+        name_size, extra_size = struct.unpack_from("<HH", mapped, info.header_offset + 26)
+        start = info.header_offset + 30 + name_size + extra_size
+        with memoryview(mapped)[start:start+info.file_size] as dex_data:
+            yield dex_data
+    finally:
+        mapped.close()
+
+
+def extract_dex(apk_file, name):
+    """
+    :param apk_file: path of the APK
+    :param name: name of the dex file in the APK
+    :return: the DexofuzzyResult of the dex file
+    """
+    with open_dex(apk_file, name) as dex_data:
+        opcodes_in_method = FastExtractOpcode().get_opcodes(dex_data)
+    return DexofuzzyResult(opcodes_in_method)
+
+
+def extract_dex_object(dex):
+    """
+    This function extracts the opcodes of a dex already parsed by androguard, the same ones
+    as ExtractOpcode without decoding the dex again.
+    :param dex: an androguard DEX, such as the ones returned by AnalyzeAPK
+    :return: the DexofuzzyResult of the dex
+    """
+    extractor = FastExtractOpcode()
+    for class_def in dex.get_classes():
+        class_data = class_def.get_class_data()
+        if "Landroid/support/" in class_def.get_name() or class_data is None:
+            continue
+        for method in class_data.get_direct_methods() + class_data.get_virtual_methods():
+            code = method.get_code()
+            if code is not None:
+                # Instructions as stored in the dex, the size is truncated as in ExtractOpcode
+                extractor.dex = code.code.insn
+                extractor.get_bytecode(0, ctypes.c_ushort(code.insns_size*2).value)
+
+    return DexofuzzyResult(extractor.opcodes_in_method)
+
+
+def hash_dex_objects(dex_objects):
+    """
+    This function compute the same hashes as hash_apk from the dex files parsed by androguard.
+    :param dex_objects: {dex name: androguard DEX}
+    :return: {"dexofuzzy": dexofuzzy of the APK, "dex": {dex name: dexofuzzy of the dex}}
+    """
+    names = sorted(dex_objects, key=_multidex_order)
+    return _hash_results(names, [extract_dex_object(dex_objects[name]) for name in names])
+
+
+def _hash_results(names, results):
+    return {
+        "dexofuzzy": DexofuzzyResult.combine(results).hash(),
+        "dex": {name: result.hash() for name, result in zip(names, results)},
+    }
+
+
+def hash_apk(apk_file, max_workers=None):
+    """
+    This function compute the dexofuzzy of every dex file of an APK and of the APK as a whole.
+    The dex files of a multidex APK are processed in parallel.
+    :param apk_file: path of the APK
+    :param max_workers: maximum number of processes, 1 processes the dex files one by one
+    :return: {"dexofuzzy": dexofuzzy of the APK, "dex": {dex name: dexofuzzy of the dex}}
+    """
+    names = get_dex_names(apk_file)
+    max_workers = min(len(names), max_workers or os.cpu_count())
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("forkserver")) as pool:
+            results = list(pool.map(extract_dex, repeat(apk_file), names))
+    else:
+        results = [extract_dex(apk_file, name) for name in names]
 
-    return dexofuzzy
+    return _hash_results(names, results)
+
+
+class DexofuzzyResult:
+    """
+    This class holds the ssdeep fragment of the opcodes of each method. The dexofuzzy of any
+    set of methods, e.g. a method or a whole APK, is the ssdeep of their joined fragments.
+    """
+    def __init__(self, opcodes_in_method: list):
+        self.fragments = []
+        previous, fragment = None, None
+        for opcodes in opcodes_in_method:
+            # ExtractOpcode yields the opcodes of each method twice in a row
+            if opcodes != previous:
+                fragment = ssdeep.hash(opcodes, encoding="UTF-8").split(":")[1]
+                previous = opcodes
+            self.fragments.append(fragment)
+
+    @classmethod
+    def combine(cls, results):
+        """
+        :param results: DexofuzzyResult of several methods or dex files
+        :return: a DexofuzzyResult holding the fragments of all of them, in order
+        """
+        combined = cls([])
+        for result in results:
+            combined.fragments.extend(result.fragments)
+        return combined
+
+    def hash(self):
+        """
+        :return: The dexofuzzy of the methods, None if there is none
+        """
+        if not self.fragments:
+            return None
+        return ssdeep.hash("".join(self.fragments), encoding="UTF-8")
 
 
 class ExtractOpcode:
@@ -60,14 +220,14 @@ class ExtractOpcode:
     def get_opcodes(self, dex_data: bytes) -> list:
         """
         This function extracts the opcode from the dex file.
-        :param dex_data: bytes
+        :param dex_data: bytes, or a memoryview such as a view of a memory-mapped dex
         :return: The opcode list of the dex file.
         """
         self.opcodes_in_method = []
         dex_magic_numbers = [b"dex\n035\x00", b"dex\n036\x00", b"dex\n037\x00",
                              b"dex\n038\x00", b"dex\n039\x00", b"dex\n040\x00"]
 
-        if isinstance(dex_data, bytes):
+        if isinstance(dex_data, (bytes, memoryview)):
             self.dex = dex_data
             self.__get_header()
             self.__get_string_ids()
@@ -120,8 +280,8 @@ class ExtractOpcode:
 
             else:
                 utf16_off = self.__get_utf16_off(utf16_size)
-                string_id = self.dex[offset+utf16_off:
-                                     offset+utf16_off+utf16_size]
+                string_id = bytes(self.dex[offset+utf16_off:
+                                           offset+utf16_off+utf16_size])
 
             string_ids.append(string_id)
 
@@ -608,3 +768,119 @@ class ExtractOpcode:
             return 3
 
         return 4
+
+
+# Width in bytes of each opcode, 0 for the 10x format which may be followed by a payload
+OPCODE_WIDTHS = (
+     0,  2,  4,  6,  2,  4,  6,  2,  4,  6,  2,  2,  2,  2,  0,  2,  # 0x00
+     2,  2,  2,  4,  6,  4,  4,  6, 10,  4,  4,  6,  4,  2,  2,  4,  # 0x10
+     4,  2,  4,  4,  6,  6,  6,  2,  2,  4,  6,  6,  6,  4,  4,  4,  # 0x20
+     4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  0,  0,  # 0x30
+     0,  0,  0,  0,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  # 0x40
+     4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  # 0x50
+     4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  6,  6,  # 0x60
+     6,  6,  6,  0,  6,  6,  6,  6,  6,  0,  0,  2,  2,  2,  2,  2,  # 0x70
+     2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  # 0x80
+     4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  # 0x90
+     4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  # 0xa0
+     2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  # 0xb0
+     2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  2,  # 0xc0
+     4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  4,  # 0xd0
+     4,  4,  4,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  # 0xe0
+     0,  0,  0,  0,  0,  0,  0,  0,  0,  0, 12,  8,  6,  6,  4,  4,  # 0xf0
+)
+
+OPCODE_NAMES = tuple(f"{opcode:02x}" for opcode in range(256))
+
+
+def skip_10x(bytecode, offset, bytecode_size, array_size_bytes=2):
+    """
+    Mirrors ExtractOpcode.__format_10x, reading out of the bytecode returns offset + 1.
+    :param bytecode: bytes, or a memoryview of the code
+    :param offset: offset of the nop, or of any 10x opcode
+    :param bytecode_size: end of the code
+    :param array_size_bytes: bytes of the element count of fill-array-data-payload which are read, ExtractOpcode
+                             only reads the low 2 of the 4 bytes of the Dalvik specification
+    :return: the offset of the next opcode
+    """
+    if offset + 1 >= bytecode_size:
+        return offset + 1
+    ident = bytecode[offset + 1]
+    if ident == 0x00 or ident > 0x03:
+        return offset + 2
+    if offset + 3 >= bytecode_size:
+        return offset + 1
+    size = bytecode[offset + 2] | bytecode[offset + 3] << 8
+    if ident == 0x01:
+        # packed-switch-payload
+        return offset + size * 4 + 8
+    if ident == 0x02:
+        # sparse-switch-payload
+        return offset + size * 8 + 4
+    # fill-array-data-payload, size is the element width here
+    if offset + 3 + array_size_bytes >= bytecode_size:
+        return offset + 1
+    elements = int.from_bytes(bytecode[offset + 4:offset + 4 + array_size_bytes], "little")
+    return offset + ((elements * size + 1) // 2 + 4) * 2
+
+
+class FastExtractOpcode(ExtractOpcode):
+    """
+    This class extracts the same opcodes as ExtractOpcode. The dex tables are decoded in bulk
+    with unpack_from/iter_unpack and only the names of the classes are read from the string
+    table. The code of each method is walked through a memoryview of the dex data with a static
+    table of opcode widths, only the payload pseudo-opcodes are decoded.
+    """
+    def get_opcodes(self, dex_data) -> list:
+        """
+        This function extracts the opcode from the dex file.
+        :param dex_data: bytes, or a memoryview such as a view of a memory-mapped dex
+        :return: The opcode list of the dex file.
+        """
+        self.opcodes_in_method = []
+        if not isinstance(dex_data, (bytes, memoryview)):
+            return self.opcodes_in_method
+
+        self.dex = dex_data
+        # ExtractOpcode does not check the magic number
+        tables = DexTables(dex_data, check_magic=False)
+        self.header = tables.header
+        self.type_ids = list(tables.type_ids)
+        for class_idx, _, _, class_data_off in tables.get_class_defs():
+            if self.__get_string(self.type_ids[class_idx]).find(b"Landroid/support/") == -1:
+                for _, code_off in tables.get_class_methods(class_data_off):
+                    if code_off != 0:
+                        self.get_bytecode(code_off + 16, ctypes.c_ushort(tables.get_insns_size(code_off)*2).value)
+
+        return self.opcodes_in_method
+
+    def __get_string(self, idx):
+        offset = struct.unpack_from("<L", self.dex, self.header["string_ids_off"] + idx*4)[0]
+        utf16_size, _ = decode_uleb128(self.dex, offset)
+        if utf16_size <= 0:
+            return b""
+        # As in ExtractOpcode, the size prefix is skipped based on its value, at most 4 bytes
+        utf16_off = min((utf16_size.bit_length() + 6) // 7, 4)
+        return bytes(self.dex[offset+utf16_off:offset+utf16_off+utf16_size])
+
+    def get_bytecode(self, offset, bytecode_size):
+        if bytecode_size and offset + bytecode_size > len(self.dex):
+            raise IndexError("bytecode out of the dex data")
+        bytecode = memoryview(self.dex)[offset:offset+bytecode_size]
+        widths = OPCODE_WIDTHS
+        names = OPCODE_NAMES
+        opcodes = []
+        current_off = 0
+        while bytecode_size > current_off:
+            opcode = bytecode[current_off]
+            opcodes.append(names[opcode])
+            width = widths[opcode]
+            if width:
+                current_off += width
+            else:
+                current_off = skip_10x(bytecode, current_off, bytecode_size)
+
+        opcodes = "".join(opcodes)
+        # ExtractOpcode appends the opcodes of each method twice
+        self.opcodes_in_method.append(opcodes)
+        self.opcodes_in_method.append(opcodes)
@@ -0,0 +1,164 @@
+import struct
+
+from androguard.core import mutf8
+
+DEX_HEADER = struct.Struct("<8sL20s20L")
+DEX_HEADER_FIELDS = ("magic_number", "checksum", "sha1", "file_size", "header_size", "endian_tag",
+                     "link_size", "link_off", "map_off", "string_ids_size", "string_ids_off",
+                     "type_ids_size", "type_ids_off", "proto_ids_size", "proto_ids_off",
+                     "field_ids_size", "field_ids_off", "method_ids_size", "method_ids_off",
+                     "class_defs_size", "class_defs_off", "data_size", "data_off")
+
+INVALID_TYPE = 'AG:ITI: invalid type'
+
+
+def decode_uleb128(data, offset):
+    """
+    :param data: bytes, or a memoryview of the dex data
+    :param offset: offset of the uleb128
+    :return: (value, size in bytes) of the uleb128
+    """
+    result = shift = size = 0
+    while True:
+        byte = data[offset+size]
+        result |= (byte & 0x7f) << shift
+        size += 1
+        if (byte & 0x80) == 0:
+            return result, size
+        shift += 7
+
+
+def read_string(dex_data, string_ids_off: int, idx: int) -> str:
+    """
+    :param dex_data: bytes, or a memoryview of the dex data
+    :param string_ids_off: offset of the string_ids table
+    :param idx: index of the string
+    :return: the string, decoded as androguard does
+    """
+    offset = struct.unpack_from('<L', dex_data, string_ids_off + idx * 4)[0]
+    utf16_size, size = decode_uleb128(dex_data, offset)
+    offset += size
+    # MUTF-8 takes at most 3 bytes per UTF-16 unit and ends with a null byte
+    data = bytes(dex_data[offset:offset + 3 * utf16_size + 1])
+    data = data[:data.find(b'\0')]
+    try:
+        # Same as MUTF-8 unless the string holds a null or a supplementary character
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+    try:
+        return mutf8.decode(data)
+    except UnicodeDecodeError:
+        return data.decode('utf-8', errors='replace')
+
+
+class DexTables:
+    """
+    This class reads the header and the tables of a dex file shared by the dexofuzzy extraction,
+    the triage and the call graph builder. The tables are decoded in bulk with unpack_from and
+    iter_unpack, each string, type, prototype or method being decoded once when requested.
+    """
+    def __init__(self, dex_data, check_magic: bool = True):
+        """
+        :param dex_data: bytes, or a memoryview such as a view of a memory-mapped dex
+        :param check_magic: raises ValueError if the data does not start with the dex magic
+        """
+        self.dex = dex_data
+        self.header = dict(zip(DEX_HEADER_FIELDS, DEX_HEADER.unpack_from(dex_data)))
+        if check_magic and bytes(self.header['magic_number'][:4]) != b'dex\n':
+            raise ValueError('not a dex file')
+        self.type_ids = struct.unpack_from(f"<{self.header['type_ids_size']}L", dex_data, self.header['type_ids_off'])
+        self.method_ids = None
+        self.strings = {}
+        self.types = {}
+        self.protos = {}
+        self.methods = {}
+
+    def get_string(self, idx: int) -> str:
+        string = self.strings.get(idx)
+        if string is None:
+            string = self.strings[idx] = read_string(self.dex, self.header['string_ids_off'], idx)
+        return string
+
+    def get_type(self, idx: int) -> str:
+        if idx >= len(self.type_ids):
+            return INVALID_TYPE
+        name = self.types.get(idx)
+        if name is None:
+            name = self.types[idx] = self.get_string(self.type_ids[idx])
+        return name
+
+    def get_type_list(self, offset: int) -> list:
+        if offset == 0:
+            return []
+        size = struct.unpack_from('<L', self.dex, offset)[0]
+        return [self.get_type(idx) for idx in struct.unpack_from(f'<{size}H', self.dex, offset + 4)]
+
+    def get_proto(self, idx: int) -> str:
+        """
+        :return: the descriptor of the prototype, formatted as androguard does, such as '(I Ljava/lang/String;)V'
+        """
+        proto = self.protos.get(idx)
+        if proto is None:
+            _, return_type_idx, parameters_off = struct.unpack_from('<3L', self.dex,
+                                                                    self.header['proto_ids_off'] + idx * 12)
+            parameters = ' '.join(self.get_type_list(parameters_off))
+            proto = self.protos[idx] = f'({parameters}){self.get_type(return_type_idx)}'
+        return proto
+
+    def get_method(self, idx: int) -> tuple:
+        """
+        :return: (class descriptor, name, descriptor) of a method_id
+        """
+        method = self.methods.get(idx)
+        if method is None:
+            if self.method_ids is None:
+                offset = self.header['method_ids_off']
+                self.method_ids = list(struct.iter_unpack(
+                    '<HHL', self.dex[offset:offset + self.header['method_ids_size'] * 8]))
+            class_idx, proto_idx, name_idx = self.method_ids[idx]
+            method = self.methods[idx] = (self.get_type(class_idx), self.get_string(name_idx), self.get_proto(proto_idx))
+        return method
+
+    def get_class_defs(self) -> list:
+        """
+        :return: (class_idx, superclass_idx, interfaces_off, class_data_off) of each class_def
+        """
+        offset = self.header['class_defs_off']
+        class_defs = self.dex[offset:offset + self.header['class_defs_size'] * 0x20]
+        return [(c[0], c[2], c[3], c[6]) for c in struct.iter_unpack('<8L', class_defs)]
+
+    def get_class_methods(self, class_data_off: int) -> list:
+        """
+        :return: (method_idx, code_off) of the direct then the virtual methods of a class_data_item
+        """
+        if class_data_off == 0:
+            return []
+        sizes = []
+        offset = class_data_off
+        for _ in range(4):
+            value, size = decode_uleb128(self.dex, offset)
+            sizes.append(value)
+            offset += size
+        static_fields, instance_fields, direct_methods, virtual_methods = sizes
+        # Each field is a pair of uleb128
+        for _ in range(2 * (static_fields + instance_fields)):
+            offset += decode_uleb128(self.dex, offset)[1]
+        methods = []
+        for count in (direct_methods, virtual_methods):
+            method_idx = 0
+            for _ in range(count):
+                diff, size = decode_uleb128(self.dex, offset)
+                offset += size
+                offset += decode_uleb128(self.dex, offset)[1]
+                code_off, size = decode_uleb128(self.dex, offset)
+                offset += size
+                method_idx += diff
+                methods.append((method_idx, code_off))
+        return methods
+
+    def get_insns_size(self, code_off: int) -> int:
+        """
+        :return: the number of 16-bit code units of the instructions of a code_item
+        """
+        return struct.unpack_from('<L', self.dex, code_off + 12)[0]
@@ -0,0 +1,175 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+from pygments import highlight, lex
+from pygments.formatters import HtmlFormatter, ImageFormatter, NullFormatter
+from pygments.lexers.jvm import JavaLexer
+
+from androcfg.code_style import U39bStyle
+from androcfg.evidence_store import write_atomic
+
+# PIL format and save parameters of the image evidence formats
+IMAGE_FORMATS = {
+    'bmp': ('BMP', {}),
+    'png': ('PNG', {'compress_level': 6}),
+    'webp': ('WEBP', {'lossless': True, 'method': 0}),
+}
+
+LEGEND_HEIGHT = 30
+LEGEND_BG = (89, 49, 150)
+LEGEND_FG = (255, 255, 255)
+LEGEND_FONT = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fonts/OpenSans-Regular.ttf')
+
+
+def add_legend(image: Image.Image, legend: str, font: ImageFont.FreeTypeFont) -> Image.Image:
+    """
+    :param image: image of the highlighted code
+    :param legend: text of the legend band
+    :param font: font of the legend
+    :return: a copy of the image with the legend band below it
+    """
+    result = Image.new(image.mode, (image.width, image.height + LEGEND_HEIGHT), LEGEND_BG)
+    result.paste(image, (0, 0))
+    text_height = font.getbbox(legend)[3]
+    draw = ImageDraw.Draw(result)
+    draw.text((10, image.height + LEGEND_HEIGHT / 2 - text_height / 2), legend, font=font, fill=LEGEND_FG)
+    return result
+
+
+class EvidenceRenderer:
+    """
+    This class renders the highlighted source of a method and its legend as an image in memory,
+    the image file is written once. The lexer, the formatter and the fonts are loaded once per thread.
+    """
+    def __init__(self, output_format: str = 'bmp', font_size: int = 12, legend_font_size: int = 12):
+        self.image_format, self.save_params = IMAGE_FORMATS[output_format]
+        self.font_size = font_size
+        self.legend_font_size = legend_font_size
+        self.local = threading.local()
+
+    def _get_formatter(self) -> ImageFormatter:
+        formatter = getattr(self.local, 'formatter', None)
+        if formatter is None:
+            # BMP is the cheapest format to encode and decode in memory
+            formatter = ImageFormatter(style=U39bStyle,
+                                       image_format='bmp',
+                                       font_name='DejaVu Sans Mono',
+                                       line_pad=4,
+                                       font_size=self.font_size,
+                                       line_number_bg='#A991D4',
+                                       line_number_fg='#ffffff')
+            self.local.formatter = formatter
+            self.local.lexer = JavaLexer()
+            self.local.legend_font = ImageFont.truetype(LEGEND_FONT, self.legend_font_size)
+        return formatter
+
+    def render(self, java_code: str, legend: str) -> Image.Image:
+        formatter = self._get_formatter()
+        buffer = BytesIO()
+        formatter.format(lex(java_code, self.local.lexer), buffer)
+        buffer.seek(0)
+        with Image.open(buffer) as image:
+            return add_legend(image, legend, self.local.legend_font)
+
+    def save(self, java_code: str, legend: str, file_path: str):
+        """
+        :param java_code: source code of the method
+        :param legend: text of the legend band
+        :param file_path: path of the image file
+        """
+        self.render(java_code, legend).save(file_path, self.image_format, **self.save_params)
+
+
+# Renderers of the current process, by output format
+_renderers = {}
+
+
+def write_evidence(output_format: str, java_code: str, legend: str, file_path: str):
+    """
+    :param output_format: html, raw or one of IMAGE_FORMATS, any other format is rendered as bmp
+    :param java_code: source code of the method
+    :param legend: legend of the image evidence
+    :param file_path: path of the evidence file
+    """
+    if output_format == 'html':
+        with open(file_path, mode='wb') as out:
+            out.write(highlight(java_code, JavaLexer(), HtmlFormatter()).encode())
+    elif output_format == 'raw':
+        with open(file_path, mode='wb') as out:
+            out.write(highlight(java_code, JavaLexer(), NullFormatter()).encode())
+    else:
+        if output_format not in IMAGE_FORMATS:
+            output_format = 'bmp'
+        if output_format not in _renderers:
+            _renderers[output_format] = EvidenceRenderer(output_format)
+        _renderers[output_format].save(java_code, legend, file_path)
+
+
+def store_evidence(output_format: str, java_code: str, legend: str, path: str):
+    write_atomic(path, lambda tmp_path: write_evidence(output_format, java_code, legend, tmp_path))
+
+
+class EvidencePool:
+    """
+    This class renders evidence files in a pool of worker processes while the analysis goes on.
+    At most twice as many jobs as processes are queued, submit blocks until one of them is done.
+    With max_processes set to 0, evidence is rendered by the calling thread.
+    A failed job leaves no evidence file, as the report does not depend on it.
+    """
+    def __init__(self, max_processes: int = None):
+        self.max_processes = os.cpu_count() if max_processes is None else max_processes
+        self.pool = None
+        self.futures = set()
+        self.lock = threading.Lock()
+        self.terminated = False
+
+    def submit(self, output_format: str, java_code: str, legend: str, path: str):
+        """
+        :param output_format: output format of the evidence
+        :param java_code: source code of the method
+        :param legend: legend of the image evidence
+        :param path: path of the evidence file
+        """
+        if self.terminated:
+            return
+        if not self.max_processes:
+            try:
+                store_evidence(output_format, java_code, legend, path)
+            except Exception:
+                pass
+            return
+        with self.lock:
+            if self.terminated:
+                return
+            if self.pool is None:
+                # Rule workers may be running, forking from a clean server process avoids inheriting their locks
+                self.pool = ProcessPoolExecutor(self.max_processes, mp_context=multiprocessing.get_context('forkserver'))
+            while len(self.futures) >= 2 * self.max_processes:
+                _, self.futures = wait(self.futures, return_when=FIRST_COMPLETED)
+            self.futures.add(self.pool.submit(store_evidence, output_format, java_code, legend, path))
+
+    def join(self):
+        """
+        Waits for every submitted job and stops the worker processes.
+        """
+        with self.lock:
+            wait(self.futures)
+            self.futures = set()
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+    def terminate(self):
+        """
+        Cancels the queued jobs and waits for the running ones, no evidence file is written afterwards.
+        """
+        with self.lock:
+            self.terminated = True
+            if self.pool is not None:
+                self.pool.shutdown(wait=True, cancel_futures=True)
+                self.pool = None
+            self.futures = set()
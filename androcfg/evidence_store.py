@@ -0,0 +1,58 @@
+import os
+import threading
+from hashlib import sha256
+from pathlib import Path
+
+
+def write_atomic(path: str, write):
+    """
+    :param path: path of the file
+    :param write: callable writing the file to the path it is given
+    """
+    # Keeps the extension last, PIL picks the image format from it
+    directory, name = os.path.split(path)
+    tmp_path = f'{directory}/.{os.getpid()}-{threading.get_ident()}.{name}'
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class EvidenceStore:
+    """
+    This class stores evidence files under the digest of their content: the decompiled source,
+    the output format and the legend. Identical evidence reached by several rules, or bundled
+    by several APKs sharing the same store directory, is rendered and written only once.
+    """
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.claimed = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def digest(source: str, output_format: str, legend: str) -> str:
+        h = sha256()
+        for part in (output_format, legend, source or ''):
+            data = part.encode('utf-8')
+            h.update(len(data).to_bytes(8, 'little'))
+            h.update(data)
+        return h.hexdigest()
+
+    def get_path(self, digest: str, output_format: str) -> str:
+        return f'{self.store_dir}/{digest[:2]}/{digest}.{output_format}'
+
+    def claim(self, digest: str, output_format: str):
+        """
+        :param digest: digest of the evidence
+        :param output_format: extension of the evidence file
+        :return: the path the evidence has to be written to, None if it is already stored or claimed
+        """
+        path = self.get_path(digest, output_format)
+        with self.lock:
+            if path in self.claimed or os.path.exists(path):
+                return None
+            self.claimed.add(path)
+        Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+        return path
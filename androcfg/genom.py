@@ -1,61 +1,306 @@
-import json
 from pprint import pprint
 
+import numpy as np
+
+from androcfg.rule_pack import RulePack
+
+GENE_DTYPE = np.uint32
+
 
 class Genom:
-    def __init__(self, rule_file: str, cluster_names: list):
+    """
+    This class counts the genes of an APK, one per (entrypoint cluster, predicate) pair. A dense
+    genome stores every count in sequence, a sparse genome only stores the counts of the genes
+    present, by gene index, for rule packs with many predicates.
+    """
+    def __init__(self, rule_file: str, cluster_names: list, sparse: bool = False, rule_pack=None):
+        """
+        :param rule_file: JSON file containing rules
+        :param cluster_names: entrypoint clusters, 'unknown' is added
+        :param sparse: stores the counts of the genes present only
+        :param rule_pack: RulePack compiled from the rules, its gene table is shared instead of built
+        """
         self.rule_file = rule_file
         self.cluster_names = cluster_names
         self.indices = {}
-        self.sequence = []
-        self.__build_indices()
-
-    def __build_indices(self):
-        with open(self.rule_file, mode='r') as r:
-            rules = json.load(r)
-
-        or_predicates = []
-        for rule in rules:
-            or_predicates.extend(rule.get('or_predicates'))
+        self.genes = []
+        self.sparse = sparse
+        self.counts = {}
+        self._sequence = None
+        self.__build_indices(rule_pack)
 
-        or_predicates.sort()
+    def __build_indices(self, rule_pack=None):
+        if rule_pack is None:
+            rule_pack = RulePack.read(self.rule_file, self.cluster_names)
         self.cluster_names.append('unknown')
         self.cluster_names.sort()
+        if rule_pack.cluster_names != self.cluster_names:
+            raise ValueError('the rule pack was compiled for other entrypoint clusters')
+        self.indices = rule_pack.indices
+        self.genes = rule_pack.genes
 
-        counter = 0
-        for predicate in or_predicates:
-            for cluster in self.cluster_names:
-                self.indices[(cluster, predicate)] = counter
-                counter += 1
-
-        self.sequence = [0]*counter
+        if not self.sparse:
+            self._sequence = np.zeros(len(self.genes), dtype=GENE_DTYPE)
 
     def __get_gene_index(self, cluster_name: str, api_call: str)->int:
         return self.indices[(cluster_name, api_call)]
 
+    def __len__(self) -> int:
+        return len(self.genes)
+
+    @property
+    def sequence(self) -> np.ndarray:
+        """
+        The dense sequence of the genome, built on each access for a sparse genome.
+        """
+        if not self.sparse:
+            return self._sequence
+        sequence = np.zeros(len(self.genes), dtype=GENE_DTYPE)
+        indices, counts = self.get_sparse()
+        sequence[indices] = counts
+        return sequence
+
+    @sequence.setter
+    def sequence(self, sequence: np.ndarray):
+        if len(sequence) != len(self.genes):
+            raise ValueError(f'genome of {len(sequence)} genes, {len(self.genes)} expected')
+        sequence = np.asarray(sequence, dtype=GENE_DTYPE)
+        if self.sparse:
+            indices = np.flatnonzero(sequence)
+            self.counts = dict(zip(indices.tolist(), sequence[indices].tolist()))
+        else:
+            self._sequence = sequence
+
     def add_gene(self, cluster_name: str, api_call: str):
         index = self.__get_gene_index(cluster_name, api_call)
-        self.sequence[index] += 1
+        if self.sparse:
+            self.counts[index] = self.counts.get(index, 0) + 1
+        else:
+            self._sequence[index] += 1
+
+    def get_genes(self) -> list:
+        """
+        :return: the (cluster, predicate) of each gene, in sequence order
+        """
+        return list(self.genes)
+
+    def get_sparse(self):
+        """
+        :return: (indices, counts) of the genes present, by increasing index
+        """
+        if not self.sparse:
+            indices = np.flatnonzero(self._sequence)
+            return indices, self._sequence[indices]
+        indices = np.array(sorted(self.counts), dtype=np.int64)
+        return indices, np.array([self.counts[i] for i in indices.tolist()], dtype=GENE_DTYPE)
+
+    def set_sparse(self, indices: np.ndarray, counts: np.ndarray):
+        """
+        :param indices: indices of the genes present
+        :param counts: count of each of these genes
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) and (indices.min() < 0 or indices.max() >= len(self.genes)):
+            raise ValueError(f'gene index out of the {len(self.genes)} genes')
+        if self.sparse:
+            self.counts = {i: c for i, c in zip(indices.tolist(), np.asarray(counts).tolist()) if c}
+        else:
+            self._sequence = np.zeros(len(self.genes), dtype=GENE_DTYPE)
+            self._sequence[indices] = counts
 
     def dump(self, file_path):
         with open(file_path, mode='w') as dump_file:
-            dump_file.write(','.join([str(e) for e in self.sequence]))
+            dump_file.write(self.dumps())
 
     def dumps(self) -> str:
-        return ','.join([str(e) for e in self.sequence])
+        """
+        :return: the comma separated counts of a dense genome, the index:count pairs of a sparse genome
+        """
+        if self.sparse:
+            return ','.join(f'{i}:{c}' for i, c in zip(*(a.tolist() for a in self.get_sparse())))
+        return ','.join(map(str, self._sequence.tolist()))
+
+    def save(self, file_path):
+        """
+        Saves the genome in the binary .npy format: the sequence of a dense genome,
+        the indices and the counts of a sparse genome as the two rows of a matrix.
+        :param file_path: path of the file
+        """
+        with open(file_path, mode='wb') as save_file:
+            if self.sparse:
+                np.save(save_file, np.vstack(self.get_sparse()).astype(GENE_DTYPE))
+            else:
+                np.save(save_file, self._sequence)
 
     def load(self, file_path):
-        with open(file_path, mode='r') as dump_file:
+        """
+        :param file_path: a file written by dump or by save, from a dense or a sparse genome
+        """
+        with open(file_path, mode='rb') as dump_file:
             content = dump_file.read()
-        self.sequence = [
-            int(elt) for elt in content.split(',')
-        ]
+        if content.startswith(b'\x93NUMPY'):
+            with open(file_path, mode='rb') as save_file:
+                data = np.load(save_file)
+            if data.ndim == 2:
+                self.set_sparse(data[0], data[1])
+            else:
+                self.sequence = data
+        else:
+            self.loads(content.decode())
+
+    def loads(self, dumps: str):
+        """
+        :param dumps: a genome as returned by dumps, from a dense or a sparse genome
+        """
+        if is_sparse(dumps):
+            self.set_sparse(*parse_sparse(dumps))
+        else:
+            self.sequence = parse(dumps)
+
+    def compare(self, genomes, metric: str = 'cosine') -> np.ndarray:
+        """
+        :param genomes: matrix of genome sequences, one per row, or list of Genom
+        :param metric: cosine, jaccard or hamming
+        :return: the similarity of this genome to each of the genomes, or the hamming distance
+        """
+        if isinstance(genomes, np.ndarray):
+            return METRICS[metric](self.sequence, genomes)
+        return sparse_compare(self.get_sparse(), [genome.get_sparse() for genome in genomes], metric)
 
     def pprint(self):
-        for i in range(0, len(self.sequence)):
-            v = self.sequence[i]
-            if v:
-                for gene, index in self.indices.items():
-                    if index == i:
-                        print(f'{gene}: {v}')
-                        break
+        for index, count in zip(*(a.tolist() for a in self.get_sparse())):
+            print(f'{self.genes[index]}: {count}')
+
+
+def is_sparse(dumps: str) -> bool:
+    return not dumps or ':' in dumps
+
+
+def parse(dumps: str, size: int = None) -> np.ndarray:
+    """
+    :param dumps: a genome as returned by Genom.dumps
+    :param size: number of genes, required to parse a sparse genome
+    :return: the sequence
+    """
+    if is_sparse(dumps):
+        if size is None:
+            raise ValueError('the number of genes of a sparse genome is required')
+        sequence = np.zeros(size, dtype=GENE_DTYPE)
+        indices, counts = parse_sparse(dumps)
+        sequence[indices] = counts
+        return sequence
+    return np.array(dumps.split(','), dtype=GENE_DTYPE)
+
+
+def parse_sparse(dumps: str):
+    """
+    :param dumps: a sparse genome as returned by Genom.dumps
+    :return: (indices, counts) of the genes present
+    """
+    pairs = np.array(dumps.replace(':', ',').split(',') if dumps else [], dtype=np.int64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1].astype(GENE_DTYPE)
+
+
+def stack(sequences, size: int = None) -> np.ndarray:
+    """
+    :param sequences: genome sequences, as arrays or as strings returned by Genom.dumps
+    :param size: number of genes, required to parse sparse genomes
+    :return: the matrix of the sequences, one per row
+    """
+    return np.vstack([parse(s, size) if isinstance(s, str) else np.asarray(s, dtype=GENE_DTYPE) for s in sequences])
+
+
+def cosine_similarity(genome: np.ndarray, genomes: np.ndarray) -> np.ndarray:
+    """
+    :param genome: a genome sequence
+    :param genomes: matrix of genome sequences, one per row
+    :return: the cosine similarity of the gene counts of the genome with each row, 0 for empty genomes
+    """
+    genome = np.asarray(genome, dtype=np.float64)
+    genomes = np.atleast_2d(np.asarray(genomes, dtype=np.float64))
+    norms = np.linalg.norm(genomes, axis=1) * np.linalg.norm(genome)
+    dots = genomes @ genome
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+
+def _presence(genome: np.ndarray, genomes: np.ndarray):
+    genome = np.asarray(genome) > 0
+    genomes = np.atleast_2d(np.asarray(genomes)) > 0
+    shared = genomes.astype(np.float32) @ genome.astype(np.float32)
+    return shared, genome.sum(), genomes.sum(axis=1)
+
+
+def jaccard_similarity(genome: np.ndarray, genomes: np.ndarray) -> np.ndarray:
+    """
+    :param genome: a genome sequence
+    :param genomes: matrix of genome sequences, one per row
+    :return: the Jaccard similarity of the genes present in the genome and in each row, 1 for two empty genomes
+    """
+    shared, count, counts = _presence(genome, genomes)
+    union = count + counts - shared
+    return np.divide(shared, union, out=np.ones_like(shared, dtype=np.float64), where=union > 0)
+
+
+def hamming_distance(genome: np.ndarray, genomes: np.ndarray) -> np.ndarray:
+    """
+    :param genome: a genome sequence
+    :param genomes: matrix of genome sequences, one per row
+    :return: the number of genes present in only one of the genome and each row
+    """
+    shared, count, counts = _presence(genome, genomes)
+    return (count + counts - 2 * shared).astype(np.int64)
+
+
+def score(metric: str, shared: np.ndarray, count: int, counts: np.ndarray, dots: np.ndarray,
+          norms: np.ndarray) -> np.ndarray:
+    """
+    Computes a metric from the statistics of a genome and of the genomes it is compared with.
+    :param metric: cosine, jaccard or hamming
+    :param shared: number of genes present in the genome and in each of the genomes
+    :param count: number of genes present in the genome
+    :param counts: number of genes present in each of the genomes
+    :param dots: dot product of the genome with each of the genomes
+    :param norms: product of the norm of the genome and of the norm of each of the genomes
+    :return: the same values as the functions of METRICS
+    """
+    if metric == 'cosine':
+        return np.divide(dots, norms, out=np.zeros(len(dots)), where=norms > 0)
+    if metric == 'jaccard':
+        union = count + counts - shared
+        return np.divide(shared, union, out=np.ones(len(shared)), where=union > 0)
+    if metric == 'hamming':
+        return (count + counts - 2 * shared).astype(np.int64)
+    raise ValueError(f'unknown metric {metric}')
+
+
+def sparse_compare(genome, genomes: list, metric: str = 'cosine') -> np.ndarray:
+    """
+    Compares sparse genomes without building their sequences.
+    :param genome: (indices, counts) of a genome, as returned by Genom.get_sparse
+    :param genomes: (indices, counts) of each of the genomes it is compared with
+    :param metric: cosine, jaccard or hamming
+    :return: the same values as the functions of METRICS
+    """
+    indices, counts = np.asarray(genome[0], dtype=np.int64), np.asarray(genome[1], dtype=np.float64)
+    lengths = np.array([len(g[0]) for g in genomes], dtype=np.int64)
+    rows = np.repeat(np.arange(len(genomes)), lengths)
+    if len(rows):
+        other_indices = np.concatenate([np.asarray(g[0], dtype=np.int64) for g in genomes])
+        other_counts = np.concatenate([np.asarray(g[1], dtype=np.float64) for g in genomes])
+    else:
+        other_indices = np.zeros(0, dtype=np.int64)
+        other_counts = np.zeros(0)
+    # Looks up the genes of the genomes among the sorted genes of the compared genome
+    positions = np.minimum(np.searchsorted(indices, other_indices), max(len(indices) - 1, 0))
+    match = indices[positions] == other_indices if len(indices) else np.zeros(len(rows), dtype=bool)
+    shared = np.bincount(rows[match], minlength=len(genomes))
+    dots = np.bincount(rows[match], weights=other_counts[match] * counts[positions[match]], minlength=len(genomes))
+    norms = np.sqrt(np.bincount(rows, weights=other_counts ** 2, minlength=len(genomes))) * np.linalg.norm(counts)
+    return score(metric, shared, len(indices), lengths, dots, norms)
+
+
+METRICS = {
+    'cosine': cosine_similarity,
+    'jaccard': jaccard_similarity,
+    'hamming': hamming_distance,
+}
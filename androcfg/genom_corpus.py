@@ -0,0 +1,255 @@
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from androcfg.evidence_store import write_atomic
+from androcfg.genom import GENE_DTYPE, score
+
+CORPUS_FORMAT = 1
+
+# Rows scanned at once when the inverted lists are built
+INDEX_CHUNK = 65536
+
+
+class GenomCorpus:
+    """
+    This class stores the genomes of many APKs as the rows of a matrix appended to genomes.bin and
+    read through a memory map, the metadata of each APK is appended to samples.jsonl. A top-k query
+    only walks the inverted lists of the genes of the queried genome, built in memory from the matrix
+    and extended as genomes are added, instead of scanning the matrix. A sample is stored once per
+    sha256 of its metadata. Writers, threads or processes, append under a lock of corpus.lock and
+    first read the samples others have appended.
+    """
+    def __init__(self, corpus_dir: str, genes: list = None):
+        """
+        :param corpus_dir: directory of the corpus
+        :param genes: (cluster, predicate) of each gene as returned by Genom.get_genes,
+                      required to create the corpus, checked against the corpus otherwise
+        """
+        self.corpus_dir = corpus_dir
+        self.meta_file = f'{corpus_dir}/corpus.json'
+        self.data_file = f'{corpus_dir}/genomes.bin'
+        self.samples_file = f'{corpus_dir}/samples.jsonl'
+        self.lock_file = f'{corpus_dir}/corpus.lock'
+        self.lock = threading.Lock()
+        if genes is not None:
+            genes = [list(gene) if gene else None for gene in genes]
+            Path(corpus_dir).mkdir(parents=True, exist_ok=True)
+        elif not os.path.exists(self.meta_file):
+            raise FileNotFoundError(f'no genome corpus in {corpus_dir}')
+        with self._lock_files():
+            if os.path.exists(self.meta_file):
+                with open(self.meta_file) as meta_file:
+                    meta = json.load(meta_file)
+                if meta['format'] != CORPUS_FORMAT:
+                    raise ValueError(f'{corpus_dir} holds a corpus of format {meta["format"]}, {CORPUS_FORMAT} expected')
+                if genes is not None and genes != meta['genes']:
+                    raise ValueError(f'{corpus_dir} holds genomes built from another rule pack')
+                self.genes = meta['genes']
+            else:
+                meta = {'format': CORPUS_FORMAT, 'genes': genes}
+                write_atomic(self.meta_file, lambda tmp_path: _write_json(tmp_path, meta))
+                self.genes = genes
+            self.row_size = len(self.genes) * np.dtype(GENE_DTYPE).itemsize
+            self.samples = []
+            self.digests = {}
+            # Size of samples.jsonl read so far
+            self.samples_end = 0
+            self._recover()
+        self.matrix = None
+        # Inverted lists: for each gene, the sorted rows where it is present and its counts, in several segments
+        self.segments = []
+        self.indexed = 0
+        self.gene_counts = np.zeros(0, dtype=np.int32)
+        self.norms = np.zeros(0)
+
+    @contextmanager
+    def _lock_files(self):
+        """
+        Locks the files of the corpus against the other processes, threads hold self.lock too.
+        """
+        with open(self.lock_file, mode='a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _recover(self):
+        """
+        Reads the samples appended since the last call, by this or another process, and drops the
+        rows an interrupted writer left without metadata, or the metadata without row. The files
+        must be locked.
+        """
+        samples = []
+        ends = [self.samples_end]
+        if os.path.exists(self.samples_file):
+            with open(self.samples_file, mode='rb') as samples_file:
+                samples_file.seek(self.samples_end)
+                for line in samples_file:
+                    if not line.endswith(b'\n'):
+                        break  # last line of an interrupted write
+                    try:
+                        samples.append(json.loads(line))
+                    except ValueError:
+                        break
+                    ends.append(ends[-1] + len(line))
+        data_size = os.path.getsize(self.data_file) if os.path.exists(self.data_file) else 0
+        rows = min(len(self.samples) + len(samples), data_size // self.row_size)
+        samples = samples[:rows - len(self.samples)]
+        end = ends[len(samples)]
+        for path, size in ((self.samples_file, end), (self.data_file, rows * self.row_size)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                os.truncate(path, size)
+        for row, sample in enumerate(samples, start=len(self.samples)):
+            if 'sha256' in sample:
+                self.digests.setdefault(sample['sha256'], row)
+        self.samples.extend(samples)
+        self.samples_end = end
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def contains(self, sha256: str) -> bool:
+        return sha256 in self.digests
+
+    def add(self, sequence: np.ndarray, sample: dict) -> int:
+        """
+        :param sequence: genome sequence of the APK
+        :param sample: metadata of the APK, its sha256 identifies it in the corpus
+        :return: row of the genome
+        """
+        return self.add_many([sequence], [sample])[0]
+
+    def add_many(self, sequences, samples: list) -> list:
+        """
+        :param sequences: genome sequences, one per APK
+        :param samples: metadata of each APK
+        :return: row of each genome
+        """
+        with self.lock, self._lock_files():
+            # Rows are numbered after the samples other processes have appended
+            self._recover()
+            rows = []
+            new_rows = []
+            new_samples = []
+            for sequence, sample in zip(sequences, samples):
+                row = self.digests.get(sample.get('sha256'))
+                if row is None:
+                    sequence = np.asarray(sequence, dtype=GENE_DTYPE)
+                    if sequence.shape != (len(self.genes),):
+                        raise ValueError(f'genome of {len(sequence)} genes, {len(self.genes)} expected')
+                    row = len(self.samples) + len(new_samples)
+                    new_rows.append(sequence)
+                    new_samples.append(sample)
+                    if 'sha256' in sample:
+                        self.digests[sample['sha256']] = row
+                rows.append(row)
+            if new_samples:
+                # The matrix is written first, metadata without row is dropped when the corpus is read
+                with open(self.data_file, mode='ab') as data_file:
+                    data_file.write(np.vstack(new_rows).tobytes())
+                lines = ''.join(json.dumps(sample) + '\n' for sample in new_samples).encode()
+                with open(self.samples_file, mode='ab') as samples_file:
+                    samples_file.write(lines)
+                self.samples.extend(new_samples)
+                self.samples_end += len(lines)
+            return rows
+
+    def get_matrix(self) -> np.ndarray:
+        """
+        :return: the genomes of the corpus, one per row, memory-mapped
+        """
+        rows = len(self.samples)
+        if self.matrix is None or len(self.matrix) != rows:
+            if rows:
+                self.matrix = np.memmap(self.data_file, dtype=GENE_DTYPE, mode='r', shape=(rows, len(self.genes)))
+            else:
+                self.matrix = np.zeros((0, len(self.genes)), dtype=GENE_DTYPE)
+        return self.matrix
+
+    def _update_index(self):
+        matrix = self.get_matrix()
+        if self.indexed == len(matrix):
+            return
+        rows_list = []
+        genes_list = []
+        counts_list = []
+        gene_counts = [self.gene_counts]
+        norms = [self.norms]
+        for start in range(self.indexed, len(matrix), INDEX_CHUNK):
+            chunk = np.asarray(matrix[start:start + INDEX_CHUNK])
+            rows, genes = np.nonzero(chunk)
+            counts = chunk[rows, genes]
+            rows_list.append((rows + start).astype(np.int32))
+            genes_list.append(genes)
+            counts_list.append(counts)
+            gene_counts.append(np.bincount(rows, minlength=len(chunk)).astype(np.int32))
+            norms.append(np.sqrt(np.bincount(rows, weights=counts.astype(np.float64) ** 2, minlength=len(chunk))))
+        rows = np.concatenate(rows_list)
+        genes = np.concatenate(genes_list)
+        counts = np.concatenate(counts_list)
+        order = np.argsort(genes, kind='stable')
+        bounds = np.cumsum(np.bincount(genes, minlength=len(self.genes)))[:-1]
+        self.segments.append((np.split(rows[order], bounds), np.split(counts[order], bounds)))
+        self.gene_counts = np.concatenate(gene_counts)
+        self.norms = np.concatenate(norms)
+        self.indexed = len(matrix)
+        # Merges the segments of genomes added one by one, a query concatenates one list per segment
+        if len(self.segments) > 8:
+            self.segments = [tuple([np.concatenate(lists) for lists in zip(*[segment[i] for segment in self.segments])]
+                                   for i in range(2))]
+
+    def _score(self, sequence: np.ndarray):
+        """
+        :param sequence: genome sequence of the queried APK
+        :return: for each genome of the corpus, the number of genes present in both genomes
+                 and the dot product of the genomes
+        """
+        genes = np.flatnonzero(sequence)
+        rows = [segment[0][gene] for segment in self.segments for gene in genes]
+        if not rows:
+            return np.zeros(self.indexed), np.zeros(self.indexed)
+        weights = [segment[1][gene] * float(sequence[gene]) for segment in self.segments for gene in genes]
+        rows = np.concatenate(rows)
+        shared = np.bincount(rows, minlength=self.indexed)
+        dots = np.bincount(rows, weights=np.concatenate(weights), minlength=self.indexed)
+        return shared, dots
+
+    def query(self, sequence: np.ndarray, k: int = 10, metric: str = 'jaccard') -> list:
+        """
+        :param sequence: genome sequence of the queried APK
+        :param k: number of samples to be returned
+        :param metric: jaccard, cosine or hamming, as in androcfg.genom
+        :return: (row, score) of the k most similar samples, the most similar first
+        """
+        sequence = np.asarray(sequence, dtype=GENE_DTYPE)
+        if sequence.shape != (len(self.genes),):
+            raise ValueError(f'genome of {len(sequence)} genes, {len(self.genes)} expected')
+        with self.lock:
+            self._update_index()
+            # Genomes sharing no gene with the queried one are only reached through the per-genome counts
+            shared, dots = self._score(sequence)
+            count = np.count_nonzero(sequence)
+            norms = self.norms * np.linalg.norm(sequence.astype(np.float64))
+            scores = score(metric, shared, count, self.gene_counts, dots, norms)
+        if metric == 'hamming':
+            scores = -scores
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        if metric == 'hamming':
+            return [(int(row), int(-scores[row])) for row in top]
+        return [(int(row), float(scores[row])) for row in top]
+
+
+def _write_json(file_path: str, obj):
+    with open(file_path, mode='w') as out:
+        json.dump(obj, out)
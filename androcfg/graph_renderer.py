@@ -0,0 +1,59 @@
+import os
+import subprocess
+import threading
+
+
+class GraphRenderer:
+    """
+    This class lays out DOT files with a bounded pool of graphviz subprocesses running
+    concurrently with the analysis. Each DOT file is rendered next to itself, as
+    graphviz.Digraph.render does.
+    """
+    def __init__(self, max_processes: int = None, engine: str = 'dot', image_format: str = 'png'):
+        self.max_processes = max_processes or os.cpu_count()
+        self.engine = engine
+        self.image_format = image_format
+        self.processes = []
+        self.failures = []
+        self.lock = threading.Lock()
+
+    def _reap(self, block: bool):
+        running = []
+        for process in self.processes:
+            if process.poll() is None:
+                running.append(process)
+            elif process.returncode != 0:
+                self.failures.append(subprocess.CalledProcessError(process.returncode, process.args))
+        if block and running and len(running) == len(self.processes):
+            running[0].wait()
+            return self._reap(block=False)
+        self.processes = running
+
+    def submit(self, dot_file: str):
+        """
+        Starts the layout of a DOT file, waits for a running layout to finish if the pool is full.
+        :param dot_file: path of the DOT file
+        """
+        cmd = ['dot', f'-K{self.engine}', f'-T{self.image_format}', '-O', dot_file]
+        with self.lock:
+            self._reap(block=len(self.processes) >= self.max_processes)
+            self.processes.append(subprocess.Popen(cmd, stdout=subprocess.DEVNULL))
+
+    def join(self):
+        """
+        Waits for every submitted layout, raises CalledProcessError if one of them failed.
+        """
+        with self.lock:
+            for process in self.processes:
+                process.wait()
+            self._reap(block=False)
+            failures, self.failures = self.failures, []
+        if failures:
+            raise failures[0]
+
+    def terminate(self):
+        with self.lock:
+            for process in self.processes:
+                process.kill()
+                process.wait()
+            self.processes = []
@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from hashlib import blake2b
+from pathlib import Path
+
+import androcfg.dekofuzzy as dekofuzzy
+
+HASH_CACHE_FORMAT = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS hashes (
+    digest BLOB PRIMARY KEY,
+    opcodes TEXT NOT NULL,
+    dexofuzzy TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS hashes_used ON hashes (used);
+CREATE TRIGGER IF NOT EXISTS hashes_insert AFTER INSERT ON hashes BEGIN
+    UPDATE meta SET value = value + NEW.size WHERE key = 'size';
+END;
+CREATE TRIGGER IF NOT EXISTS hashes_delete AFTER DELETE ON hashes BEGIN
+    UPDATE meta SET value = value - OLD.size WHERE key = 'size';
+END;
+INSERT OR IGNORE INTO meta VALUES ('size', 0);
+'''
+
+
+class HashCache:
+    """
+    This class persists the opcodes and the dexofuzzy hash of method bytecodes in a SQLite
+    database shared by runs and by batch workers, keyed by the BLAKE2b digest of the bytecode.
+    Writes and last-use updates are buffered and flushed in a single transaction. Least recently
+    used entries are evicted once the stored opcodes and hashes exceed max_size bytes.
+    """
+    def __init__(self, path: str, max_size: int = 1024 * 1024 * 1024, timeout: float = 60.0,
+                 flush_every: int = 256):
+        self.path = path
+        self.max_size = max_size
+        self.flush_every = flush_every
+        self.inserts = {}
+        self.touched = set()
+        self.lock = threading.Lock()
+        Path(os.path.dirname(os.path.abspath(path))).mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        with self._transaction():
+            version = self.db.execute("SELECT value FROM meta WHERE key = 'format'").fetchone()
+            if version is None or version[0] != HASH_CACHE_FORMAT:
+                self.db.execute('DELETE FROM hashes')
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('format', ?)", (HASH_CACHE_FORMAT,))
+
+    @contextmanager
+    def _transaction(self):
+        # Takes the write lock upfront, a concurrent writer then waits for the busy timeout
+        # instead of failing to upgrade its read lock
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.db
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    @staticmethod
+    def digest(bytecode: bytes) -> bytes:
+        return blake2b(bytecode, digest_size=16).digest()
+
+    def get(self, bytecode: bytes):
+        """
+        :param bytecode: raw bytecode of a method
+        :return: (opcodes, dexofuzzy) of the bytecode, None if it is not cached
+        """
+        digest = self.digest(bytecode)
+        with self.lock:
+            entry = self.inserts.get(digest)
+            if entry is None:
+                entry = self.db.execute('SELECT opcodes, dexofuzzy FROM hashes WHERE digest = ?', (digest,)).fetchone()
+                if entry is None:
+                    return None
+                self.touched.add(digest)
+        return entry[0].split(','), entry[1]
+
+    def put(self, bytecode: bytes, opcodes: list, dexofuzzy_hash: str):
+        with self.lock:
+            self.inserts[self.digest(bytecode)] = (','.join(opcodes), dexofuzzy_hash)
+            if len(self.inserts) + len(self.touched) >= self.flush_every:
+                self._flush()
+
+    def hash(self, bytecode: bytes) -> str:
+        """
+        :param bytecode: raw bytecode of a method
+        :return: the dexofuzzy hash of the bytecode, as dekofuzzy.hash
+        """
+        entry = self.get(bytecode)
+        if entry is not None:
+            return entry[1]
+        opcodes = dekofuzzy.extract_bytecode(bytecode)
+        dexofuzzy_hash = dekofuzzy.DexofuzzyResult(opcodes).hash()
+        self.put(bytecode, opcodes, dexofuzzy_hash)
+        return dexofuzzy_hash
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.inserts and not self.touched:
+            return
+        now = time.time()
+        with self._transaction():
+            self.db.executemany('INSERT OR IGNORE INTO hashes VALUES (?, ?, ?, ?, ?)',
+                                ((digest, opcodes, dexofuzzy_hash, len(opcodes) + len(dexofuzzy_hash), now)
+                                 for digest, (opcodes, dexofuzzy_hash) in self.inserts.items()))
+            self.db.executemany('UPDATE hashes SET used = ? WHERE digest = ?',
+                                ((now, digest) for digest in self.touched))
+            size = self._size()
+            if size > self.max_size:
+                # Evicts down to 90% of the budget so eviction does not run on every flush
+                excess = size - int(self.max_size * 0.9)
+                evicted = []
+                for digest, entry_size in self.db.execute('SELECT digest, size FROM hashes ORDER BY used'):
+                    if excess <= 0:
+                        break
+                    evicted.append((digest,))
+                    excess -= entry_size
+                self.db.executemany('DELETE FROM hashes WHERE digest = ?', evicted)
+        self.inserts = {}
+        self.touched = set()
+
+    def _size(self) -> int:
+        return self.db.execute("SELECT value FROM meta WHERE key = 'size'").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.db.close()
+
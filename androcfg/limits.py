@@ -0,0 +1,54 @@
+import resource
+import signal
+from contextlib import contextmanager
+
+
+class AnalysisAborted(BaseException):
+    """
+    Raised when the analysis of an APK exceeds one of its limits. It derives from BaseException,
+    as KeyboardInterrupt does, so that the handlers catching any Exception let it through.
+    """
+    def __init__(self, reason: str, limit, message: str = ''):
+        super().__init__(message or f'{reason} limit of {limit} exceeded')
+        self.reason = reason
+        self.limit = limit
+
+    def to_dict(self) -> dict:
+        return {
+            'reason': self.reason,
+            'limit': self.limit,
+            'message': str(self),
+        }
+
+
+def limit_memory(max_memory: int):
+    """
+    Caps the address space of the current process, allocations beyond raise MemoryError.
+    :param max_memory: maximum address space in bytes, no limit if None
+    """
+    if max_memory:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, hard))
+
+
+@contextmanager
+def wall_clock_limit(timeout: float):
+    """
+    Raises AnalysisAborted in the main thread once timeout seconds have elapsed.
+    Subprocesses started with subprocess.run, such as graphviz, are killed on the way out.
+    :param timeout: limit in seconds, no limit if None
+    """
+    if not timeout:
+        yield
+        return
+
+    def on_timeout(signum, frame):
+        raise AnalysisAborted('timeout', timeout)
+
+    previous = signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
@@ -0,0 +1,110 @@
+import re
+
+REGEX_CHARS = set('.^$*+?{}[]\\|()')
+OPTIONAL_CHARS = set('*?{')
+
+
+def literal_prefix(pattern: str) -> str:
+    """
+    Returns the longest literal prefix that any string matched by re.match(pattern) starts with.
+    :param pattern: regular expression
+    :return: the literal prefix of the pattern
+    """
+    if '|' in pattern:
+        return ''
+    for i, c in enumerate(pattern):
+        if c in REGEX_CHARS:
+            if c in OPTIONAL_CHARS:
+                return pattern[:max(i - 1, 0)]
+            return pattern[:i]
+    return pattern
+
+
+class ClassTrie:
+    """
+    This class stores class descriptors in a trie over their package segments.
+    """
+    def __init__(self):
+        self.root = {}
+
+    def add(self, descriptor: str):
+        node = self.root
+        for part in descriptor.split('/'):
+            node = node.setdefault(part, {})
+        node[None] = descriptor
+
+    def prefixed(self, prefix: str) -> list:
+        """
+        :param prefix: beginning of a class descriptor
+        :return: every stored class descriptor starting with prefix
+        """
+        parts = prefix.split('/')
+        node = self.root
+        for part in parts[:-1]:
+            node = node.get(part)
+            if node is None:
+                return []
+        descriptors = []
+        pending = [child for key, child in node.items() if key is not None and key.startswith(parts[-1])]
+        while pending:
+            node = pending.pop()
+            for key, child in node.items():
+                if key is None:
+                    descriptors.append(child)
+                else:
+                    pending.append(child)
+        return descriptors
+
+
+class MethodIndex:
+    """
+    This class indexes the methods of an androguard Analysis by class descriptor and method name.
+    Lookups have the same semantics as Analysis.find_methods: both names are regular
+    expressions matched at the beginning of the class descriptor and of the method name.
+    """
+    def __init__(self, analysis=None):
+        self.methods = {}
+        self.ranks = {}
+        self.classes = ClassTrie()
+        if analysis is not None:
+            for clazz in analysis.get_classes():
+                self.add_class(clazz.name, [(m.get_method().get_name(), m) for m in clazz.get_methods()])
+
+    def __iter__(self):
+        for methods in self.methods.values():
+            for _, method in methods:
+                yield method
+
+    def add_class(self, class_name: str, methods: list):
+        """
+        :param class_name: class descriptor
+        :param methods: list of (method_name, method) tuples
+        """
+        if class_name not in self.methods:
+            self.ranks[class_name] = len(self.ranks)
+            self.classes.add(class_name)
+            self.methods[class_name] = []
+        self.methods[class_name].extend(methods)
+
+    def find(self, class_name: str, method_name: str) -> list:
+        """
+        :param class_name: regular expression for the class descriptor
+        :param method_name: regular expression for the method name
+        :return: the matching methods, in the order Analysis.find_methods yields them
+        """
+        class_prefix = literal_prefix(class_name)
+        candidates = self.classes.prefixed(class_prefix)
+        if class_prefix != class_name:
+            candidates = [c for c in candidates if re.match(class_name, c)]
+        candidates.sort(key=self.ranks.get)
+
+        method_prefix = literal_prefix(method_name)
+        methods = []
+        for c in candidates:
+            for name, method in self.methods[c]:
+                if not name.startswith(method_prefix):
+                    continue
+                if method_prefix != method_name and not re.match(method_name, name):
+                    continue
+                methods.append(method)
+        return methods
@@ -0,0 +1,137 @@
+import networkx as nx
+
+from androcfg.compact_graph import CompactCallGraph
+
+
+class Reachability:
+    """
+    This class labels every node of a call graph with the set of targets it can reach.
+    The graph is condensed into strongly connected components once and the labels,
+    stored as integer bitsets, are propagated in a single reverse topological pass.
+    """
+    def __init__(self, call_graph, targets: list):
+        if not isinstance(call_graph, CompactCallGraph):
+            call_graph = CompactCallGraph.from_networkx(call_graph)
+        self.call_graph = call_graph
+        self.nodes = call_graph.nodes
+        self.ids = call_graph.ids
+        self.bits = {}
+        for t in targets:
+            if t in self.ids and t not in self.bits:
+                self.bits[t] = 1 << len(self.bits)
+        self.labels = []
+        self.__compute_labels()
+        self.__compute_roots()
+
+    def __compute_labels(self):
+        pointers = self.call_graph.successors_ptr.tolist()
+        successors = self.call_graph.successors_idx.tolist()
+        seeds = [0] * len(self.nodes)
+        for t, bit in self.bits.items():
+            seeds[self.ids[t]] = bit
+
+        # Iterative Tarjan: components are emitted sinks first, so every successor
+        # component outside the current one already carries its final label.
+        size = len(self.nodes)
+        index = [-1] * size
+        low = [0] * size
+        on_stack = [False] * size
+        component = [-1] * size
+        labels = [0] * size
+        stack = []
+        counter = 0
+        components = 0
+        for root in range(size):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [(root, pointers[root])]
+            while work:
+                v, i = work[-1]
+                if i < pointers[v + 1]:
+                    work[-1] = (v, i + 1)
+                    w = successors[i]
+                    if index[w] == -1:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = True
+                        work.append((w, pointers[w]))
+                    elif on_stack[w] and index[w] < low[v]:
+                        low[v] = index[w]
+                    continue
+
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    if low[v] < low[u]:
+                        low[u] = low[v]
+                if low[v] != index[v]:
+                    continue
+
+                members = []
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    component[w] = components
+                    members.append(w)
+                    if w == v:
+                        break
+                label = 0
+                for w in members:
+                    label |= seeds[w]
+                    for x in successors[pointers[w]:pointers[w + 1]]:
+                        if component[x] != components:
+                            label |= labels[x]
+                for w in members:
+                    labels[w] = label
+                components += 1
+
+        self.labels = labels
+
+    def mask(self, target) -> int:
+        """
+        :param target: a target node
+        :return: the bit of the target, 0 if the target is not part of the call graph
+        """
+        return self.bits.get(target, 0)
+
+    def __compute_roots(self):
+        self._roots = {}
+        for i, degree in enumerate(self.call_graph.in_degrees().tolist()):
+            label = self.labels[i]
+            if not label or degree != 0:
+                continue
+            while label:
+                low_bit = label & -label
+                self._roots.setdefault(low_bit, []).append(self.nodes[i])
+                label ^= low_bit
+
+    def roots(self, target) -> list:
+        """
+        :param target: a target node
+        :return: the nodes without any caller from which the target is reachable
+        """
+        return self._roots.get(self.mask(target), [])
+
+    def subgraph(self, targets: list) -> nx.DiGraph:
+        """
+        Equivalent to the union of the call graph restricted to the ancestors of each target,
+        the edges being added target after target as the rules add them.
+        :param targets: target nodes
+        :return: the edges leading to at least one of the targets
+        """
+        graph = nx.DiGraph()
+        done = 0
+        for target in targets:
+            bit = self.mask(target)
+            if not bit & ~done:
+                continue
+            done |= bit
+            ids = [i for i, label in enumerate(self.labels) if label & bit]
+            sources, successors = self.call_graph.subgraph_edges(ids)
+            graph.add_edges_from((self.nodes[u], self.nodes[v]) for u, v in zip(sources.tolist(), successors.tolist()))
+        return graph
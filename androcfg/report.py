@@ -1,14 +1,26 @@
 import json
 import os
+from pathlib import Path
 
 from androguard.core.apk import APK
 from pybars import Compiler
 
 
+def write_aborted_report(output_dir, aborted: dict):
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    ctx = {
+        'aborted': aborted,
+        'rules': []
+    }
+    with open(f'{output_dir}/report.json', mode='w') as json_report:
+        json.dump(ctx, json_report)
+
+
 class MdReport:
-    def __init__(self, rules_report, apk: APK):
+    def __init__(self, rules_report, apk: APK, dexofuzzy: dict = None):
         self.rules_report = rules_report
         self.apk = apk
+        self.dexofuzzy = dexofuzzy
 
     def generate(self, output_dir):
         app = {
@@ -27,6 +39,8 @@ class MdReport:
             'app': app,
             'rules': self.rules_report
         }
+        if self.dexofuzzy:
+            ctx['dexofuzzy'] = self.dexofuzzy
         with open(f'{output_dir}/report.json', mode='w') as json_report:
             json.dump(ctx, json_report)
         compiler = Compiler()
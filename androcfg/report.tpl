@@ -1,5 +1,8 @@
 ## {{app.name}}
 We have statically analyzed the Android application {{app.name}} `{{app.package}}` available on [Google Play](https://play.google.com/store/apps/details?id={{app.package}}) in its version `{{app.version_name}}`.
+{{#if dexofuzzy}}
+Its dexofuzzy is `{{dexofuzzy.dexofuzzy}}`.
+{{/if}}
 
 ### Permissions
 This application requests the following permissions:
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+from hashlib import sha256
+
+from androcfg.evidence_store import write_atomic
+
+RULE_PACK_FORMAT = 2
+RULE_PACK_MAGIC = b'ACFGPACK'
+
+
+class RulePack:
+    """
+    This class holds a rule pack compiled from its JSON file once for all the APKs analyzed by a
+    process: the rules, the class and method parts of each predicate, the gene table of the genomes
+    and the rules of each predicate. A compiled pack can be saved to a file holding these tables as
+    JSON, which loads faster than the rules are compiled.
+    """
+    def __init__(self, rules: list, cluster_names: list):
+        """
+        :param rules: rules as read from the JSON file
+        :param cluster_names: entrypoint clusters of the genes, 'unknown' is added
+        """
+        self.rules = rules
+        self.version = sha256(json.dumps(rules, sort_keys=True).encode('utf-8')).hexdigest()
+        # Predicates in order of first use, each resolved once per APK
+        self.predicates = []
+        self.keys = {}
+        self.predicate_rules = {}
+        for i, rule in enumerate(rules):
+            for predicate in rule['or_predicates']:
+                if predicate not in self.keys:
+                    class_name, _, method_name = predicate.rpartition('/')
+                    self.predicates.append(predicate)
+                    self.keys[predicate] = (class_name, method_name)
+                    self.predicate_rules[predicate] = []
+                if i not in self.predicate_rules[predicate]:
+                    self.predicate_rules[predicate].append(i)
+
+        # Genes by predicate then by cluster, a predicate used by several rules keeps several genes
+        self.cluster_names = sorted(list(cluster_names) + ['unknown'])
+        self.genes = []
+        self.indices = {}
+        for predicate in sorted(p for rule in rules for p in rule['or_predicates']):
+            for cluster in self.cluster_names:
+                self.indices[(cluster, predicate)] = len(self.genes)
+                self.genes.append((cluster, predicate))
+
+    def save(self, file_path: str):
+        data = {
+            'format': RULE_PACK_FORMAT,
+            'version': self.version,
+            'rules': self.rules,
+            'cluster_names': self.cluster_names,
+            'predicates': self.predicates,
+            'keys': self.keys,
+            'predicate_rules': self.predicate_rules,
+            'genes': self.genes,
+        }
+
+        def write(tmp_path):
+            with open(tmp_path, mode='wb') as pack_file:
+                pack_file.write(RULE_PACK_MAGIC)
+                pack_file.write(json.dumps(data).encode('utf-8'))
+        write_atomic(file_path, write)
+
+    @staticmethod
+    def read(file_path: str, cluster_names: list):
+        """
+        :param file_path: JSON file containing rules, or rule pack written by save
+        :param cluster_names: entrypoint clusters of the genes
+        :return: the RulePack
+        """
+        with open(file_path, mode='rb') as pack_file:
+            content = pack_file.read()
+        if not content.startswith(RULE_PACK_MAGIC):
+            return RulePack(json.loads(content), cluster_names)
+        try:
+            data = json.loads(content[len(RULE_PACK_MAGIC):])
+        except ValueError:
+            # Packs of format 1 were pickled, they are never unpickled
+            raise ValueError(f'{file_path} is not a rule pack of format {RULE_PACK_FORMAT}, compile it again')
+        if data['format'] != RULE_PACK_FORMAT:
+            raise ValueError(f'{file_path} is a rule pack of format {data["format"]}, compile it again')
+        if data['cluster_names'] != sorted(list(cluster_names) + ['unknown']):
+            raise ValueError(f'{file_path} was compiled for other entrypoint clusters, compile it again')
+        # The tables are restored as compiled, without compiling the rules again
+        pack = RulePack.__new__(RulePack)
+        pack.rules = data['rules']
+        pack.version = data['version']
+        pack.predicates = data['predicates']
+        pack.keys = {predicate: tuple(key) for predicate, key in data['keys'].items()}
+        pack.predicate_rules = data['predicate_rules']
+        pack.cluster_names = data['cluster_names']
+        pack.genes = [tuple(gene) for gene in data['genes']]
+        pack.indices = {gene: i for i, gene in enumerate(pack.genes)}
+        return pack
+
+# Rule packs of the current process, by file and modification time
+_packs = {}
+_packs_lock = threading.Lock()
+
+
+def load_rule_pack(file_path: str, cluster_names: list) -> RulePack:
+    """
+    Reads a rule pack once per process, until its file changes.
+    :param file_path: JSON file containing rules, or rule pack written by RulePack.save
+    :param cluster_names: entrypoint clusters of the genes
+    :return: the RulePack, shared by the callers, which must not modify it
+    """
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size, tuple(cluster_names))
+    with _packs_lock:
+        if key not in _packs:
+            _packs[key] = RulePack.read(file_path, cluster_names)
+        return _packs[key]
@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+import zlib
+
+from androcfg.evidence_renderer import store_evidence
+from androcfg.evidence_store import EvidenceStore
+
+ARCHIVE_FORMAT = 1
+
+
+class SourceArchive:
+    """
+    This class persists, per APK, the decompiled source of the methods quoted by findings so that
+    evidence files are only rendered when requested. Sources are compressed one by one and appended
+    to sources.bin, sources.json maps finding ids to their offset, length and legend.
+    """
+    def __init__(self, output_dir: str):
+        self.data_file = f'{output_dir}/sources.bin'
+        self.index_file = f'{output_dir}/sources.json'
+        self.sources = {}
+        self.out = None
+        self.lock = threading.Lock()
+
+    def add(self, finding_id: str, source: str, legend: str):
+        data = zlib.compress(source.encode('utf-8'))
+        with self.lock:
+            if finding_id in self.sources:
+                return
+            if self.out is None:
+                self.out = open(self.data_file, mode='wb')
+            self.sources[finding_id] = (self.out.tell(), len(data), legend)
+            self.out.write(data)
+
+    def close(self, output_format: str, evidence_dir: str):
+        """
+        Writes the index of the archive.
+        :param output_format: format evidence files are rendered to
+        :param evidence_dir: directory of the evidence store
+        """
+        with self.lock:
+            if self.out is not None:
+                self.out.close()
+                self.out = None
+            index = {
+                'format': ARCHIVE_FORMAT,
+                'output_format': output_format,
+                'evidence_dir': os.path.relpath(evidence_dir, start=os.path.dirname(self.index_file)),
+                'sources': self.sources,
+            }
+            with open(self.index_file, mode='w') as index_file:
+                json.dump(index, index_file)
+
+    @staticmethod
+    def read(output_dir: str, finding_id: str):
+        """
+        :param output_dir: output directory of the APK
+        :param finding_id: id of a finding of the report
+        :return: (source, legend, index) of the finding
+        """
+        with open(f'{output_dir}/sources.json') as index_file:
+            index = json.load(index_file)
+        if finding_id not in index['sources']:
+            raise KeyError(f'no source archived for finding {finding_id}')
+        offset, length, legend = index['sources'][finding_id]
+        with open(f'{output_dir}/sources.bin', mode='rb') as data_file:
+            data_file.seek(offset)
+            source = zlib.decompress(data_file.read(length)).decode('utf-8')
+        return source, legend, index
+
+
+def render_finding(output_dir: str, finding_id: str) -> str:
+    """
+    Renders the evidence file of a finding of a report generated in lazy evidence mode.
+    :param output_dir: output directory of the APK
+    :param finding_id: id of a finding of the report
+    :return: path of the evidence file
+    """
+    source, legend, index = SourceArchive.read(output_dir, finding_id)
+    output_format = index['output_format']
+    store = EvidenceStore(os.path.join(output_dir, index['evidence_dir']))
+    digest = EvidenceStore.digest(source, output_format, legend)
+    path = store.claim(digest, output_format)
+    if path:
+        store_evidence(output_format, source, legend, path)
+    return store.get_path(digest, output_format)
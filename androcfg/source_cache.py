@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+import androcfg.dekofuzzy as dekofuzzy
+
+
+class MethodSource:
+    __slots__ = ('source', 'bytecode', 'dexofuzzy_hash')
+
+    def __init__(self, source: str, bytecode: bytes, dexofuzzy_hash: str):
+        self.source = source
+        self.bytecode = bytecode
+        self.dexofuzzy_hash = dexofuzzy_hash
+
+    def size(self) -> int:
+        return len(self.source or '') + len(self.bytecode) + len(self.dexofuzzy_hash)
+
+
+class SourceCache:
+    """
+    This class memoizes, per APK, the decompiled source, the raw bytecode and the dexofuzzy hash
+    of methods, keyed by their full name. Least recently used entries are evicted once the
+    cached data exceeds max_size bytes. A method requested by several threads at once is
+    decompiled by only one of them.
+    """
+    def __init__(self, max_size: int = 64 * 1024 * 1024, hash_cache=None):
+        self.max_size = max_size
+        self.hash_cache = hash_cache
+        self.size = 0
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def compute(self, method) -> MethodSource:
+        bytecode = b''
+        if method.get_code():
+            bytecode = bytes(method.get_code().get_raw())
+        if self.hash_cache:
+            dexofuzzy_hash = self.hash_cache.hash(bytecode)
+        else:
+            dexofuzzy_hash = dekofuzzy.hash(bytecode)
+        return MethodSource(method.get_source(), bytecode, dexofuzzy_hash)
+
+    def get(self, method) -> MethodSource:
+        """
+        :param method: an androguard EncodedMethod
+        :return: the MethodSource of the method, computed if it is not cached
+        """
+        key = method.full_name
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    return entry
+                event = self.pending.get(key)
+                if event is None:
+                    self.pending[key] = threading.Event()
+                    break
+            event.wait()
+
+        try:
+            entry = self.compute(method)
+            self.put(key, entry)
+            return entry
+        finally:
+            with self.lock:
+                self.pending.pop(key).set()
+
+    def put(self, key: str, entry: MethodSource):
+        size = entry.size()
+        if size > self.max_size:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key).size()
+            self.entries[key] = entry
+            self.size += size
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size()
@@ -0,0 +1,60 @@
+import numpy as np
+
+from androcfg.dekofuzzy import get_dex_names, open_dex
+from androcfg.dex_tables import DexTables
+from androcfg.method_index import MethodIndex
+
+METHOD_ID = np.dtype([('class_idx', '<u2'), ('proto_idx', '<u2'), ('name_idx', '<u4')])
+
+
+def read_method_ids(dex_data) -> dict:
+    """
+    Reads the class descriptor and the name of every method_id of a dex file, that is every method
+    it defines or references, without parsing its code.
+    :param dex_data: bytes, or a memoryview such as a view of a memory-mapped dex
+    :return: the method names of each class descriptor
+    """
+    tables = DexTables(dex_data)
+    # Copied so that no array keeps the memory-mapped dex exported
+    method_ids = np.frombuffer(dex_data, dtype=METHOD_ID, count=tables.header['method_ids_size'],
+                               offset=tables.header['method_ids_off']).copy()
+    pairs = np.unique(method_ids['class_idx'].astype(np.int64) << 32 | method_ids['name_idx'])
+
+    classes = {}
+    for pair in pairs.tolist():
+        class_name = tables.get_string(tables.type_ids[pair >> 32])
+        classes.setdefault(class_name, set()).add(tables.get_string(pair & 0xffffffff))
+    return classes
+
+
+def read_apk_methods(apk_file: str) -> MethodIndex:
+    """
+    :param apk_file: path of the APK
+    :return: MethodIndex of the (class descriptor, method name) of the method_ids of every classes*.dex
+    """
+    classes = {}
+    for name in get_dex_names(apk_file):
+        with open_dex(apk_file, name) as dex_data:
+            for class_name, method_names in read_method_ids(dex_data).items():
+                classes.setdefault(class_name, set()).update(method_names)
+    method_index = MethodIndex()
+    for class_name, method_names in classes.items():
+        method_index.add_class(class_name, [(method_name, method_name) for method_name in sorted(method_names)])
+    return method_index
+
+
+def triage_apk(apk_file: str, rule_pack) -> list:
+    """
+    Finds the rules which may match the APK: those with a predicate matching one of the methods the
+    dex files define or reference, with the semantics of MethodIndex.find. The other rules cannot
+    report anything for the APK.
+    :param apk_file: path of the APK
+    :param rule_pack: RulePack of the rules
+    :return: the indices of these rules in the rule pack, in rule order
+    """
+    method_index = read_apk_methods(apk_file)
+    rules = set()
+    for predicate in rule_pack.predicates:
+        if method_index.find(*rule_pack.keys[predicate]):
+            rules.update(rule_pack.predicate_rules[predicate])
+    return sorted(rules)
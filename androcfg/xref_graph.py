@@ -0,0 +1,184 @@
+import threading
+from contextlib import ExitStack
+
+from androguard.core.analysis.analysis import MethodAnalysis
+from androguard.core.dex import DEX
+from androguard.decompiler.decompiler import DecompilerDAD
+
+from androcfg.analysis_cache import MethodRef
+from androcfg.compact_graph import CompactCallGraph
+from androcfg.dekofuzzy import OPCODE_WIDTHS, get_dex_names, open_dex, skip_10x
+from androcfg.dex_tables import DexTables
+from androcfg.method_index import MethodIndex
+
+# Width in bytes of each opcode as in the Dalvik specification: dekofuzzy keeps the 12 bytes of
+# invoke-polymorphic its hashes are computed with, unused opcodes take one code unit and nop may
+# start a payload
+CODE_WIDTHS = tuple(8 if opcode == 0xfa else width or 2 for opcode, width in enumerate(OPCODE_WIDTHS))
+
+# const-class and new-instance, AnalyzeAPK creates an external class for their type
+TYPE_OPCODES = frozenset((0x1c, 0x22))
+# invoke-kind (35c), invoke-kind/range (3rc), invoke-polymorphic (45cc) and invoke-polymorphic/range (4rcc)
+INVOKE_OPCODES = frozenset(list(range(0x6e, 0x73)) + list(range(0x74, 0x79)) + [0xfa, 0xfb])
+
+# Version of the call graphs built here, part of their analysis cache key
+XREF_GRAPH_VERSION = 1
+
+EXTERNAL_SUPERCLASS = 'Ljava/lang/Object;'
+
+
+def get_references(tables: DexTables, code_off: int) -> list:
+    """
+    Walks the instructions of a code_item.
+    :param tables: DexTables of the dex defining the code_item
+    :param code_off: offset of the code_item
+    :return: (opcode, index) of its const-class, new-instance and invoke instructions, in order
+    """
+    if code_off == 0:
+        return []
+    dex = tables.dex
+    offset = code_off + 16
+    end = offset + tables.get_insns_size(code_off) * 2
+    if end > len(dex):
+        raise IndexError('bytecode out of the dex data')
+    widths = CODE_WIDTHS
+    references = []
+    while offset < end:
+        opcode = dex[offset]
+        if opcode in INVOKE_OPCODES or opcode in TYPE_OPCODES:
+            references.append((opcode, dex[offset + 2] | dex[offset + 3] << 8))
+        if opcode:
+            offset += widths[opcode]
+        else:
+            # The whole element count of fill-array-data-payload is read, unlike dekofuzzy
+            offset = skip_10x(dex, offset, end, array_size_bytes=4)
+    return references
+
+
+def build_call_graph(apk_file: str, dex_names: list = None):
+    """
+    Builds the call graph AnalyzeAPK would return, with the same methods, calls and classes, from
+    the invoke instructions of the dex files only. Strings, fields, basic blocks and the other
+    cross references are not computed. The nodes are MethodRef: a method of a class defined by
+    several dex files is a single node. Unlike AnalyzeAPK, invoke-polymorphic calls are edges.
+    :param apk_file: path of the APK
+    :param dex_names: names of the dex files in the order androguard loads them, get_dex_names if None
+    :return: (CompactCallGraph, MethodIndex, class hierarchy, name of the dex file defining each class)
+    """
+    if dex_names is None:
+        dex_names = get_dex_names(apk_file)
+    classes = {}
+    hierarchy = {}
+    class_dex = {}
+    refs = {}
+    calls = {}
+
+    def resolve(key):
+        # As Analysis._resolve_method, an unknown method is added to its class, created as external if needed
+        ref = refs.get(key)
+        if ref is None:
+            if key[0] not in classes:
+                classes[key[0]] = {}
+                hierarchy[key[0]] = (EXTERNAL_SUPERCLASS, [])
+            ref = refs[key] = classes[key[0]][key] = MethodRef(*key)
+        return ref
+
+    with ExitStack() as stack:
+        # Every dex is seeded before the references are resolved, a class defined twice keeps its first position
+        definitions = []
+        for dex_name in dex_names:
+            tables = DexTables(stack.enter_context(open_dex(apk_file, dex_name)))
+            for class_idx, superclass_idx, interfaces_off, class_data_off in tables.get_class_defs():
+                class_name = tables.get_type(class_idx)
+                methods = classes[class_name] = {}
+                hierarchy[class_name] = (tables.get_type(superclass_idx), tables.get_type_list(interfaces_off))
+                class_dex[class_name] = dex_name
+                code = []
+                for method_idx, code_off in tables.get_class_methods(class_data_off):
+                    _, name, descriptor = tables.get_method(method_idx)
+                    key = (class_name, name, descriptor)
+                    ref = refs.setdefault(key, MethodRef(*key))
+                    methods[key] = ref
+                    code.append((ref, code_off))
+                definitions.append((tables, class_name, code))
+
+        for tables, class_name, code in definitions:
+            for ref, code_off in code:
+                # The calls of a class defined by several dex files are merged
+                callees = calls.setdefault(ref, [])
+                for opcode, idx in get_references(tables, code_off):
+                    if opcode in TYPE_OPCODES:
+                        type_name = tables.get_type(idx).lstrip('[')
+                        if type_name.startswith('L') and type_name != class_name and type_name not in classes:
+                            classes[type_name] = {}
+                            hierarchy[type_name] = (EXTERNAL_SUPERCLASS, [])
+                        continue
+                    callee_class, name, descriptor = tables.get_method(idx)
+                    callee_class = callee_class.lstrip('[')
+                    if callee_class.startswith('L'):
+                        callees.append(resolve((callee_class, name, descriptor)))
+
+    # Nodes and edges in the order of Analysis.get_call_graph
+    ids = {}
+    sources = []
+    targets = []
+    method_index = MethodIndex()
+    for class_name, methods in classes.items():
+        method_index.add_class(class_name, [(ref.name, ref) for ref in methods.values()])
+        for ref in methods.values():
+            i = ids.setdefault(ref, len(ids))
+            callees = set()
+            for callee in calls.get(ref, ()):
+                j = ids.setdefault(callee, len(ids))
+                if j not in callees:
+                    callees.add(j)
+                    sources.append(i)
+                    targets.append(j)
+    return CompactCallGraph(list(ids), sources, targets), method_index, hierarchy, class_dex
+
+
+class MethodAnalyses:
+    """
+    This class stands for the Analysis the androguard decompiler is given, it analyzes a method
+    only when its source is requested.
+    """
+    def __init__(self, dex: DEX):
+        self.dex = dex
+
+    def get_method(self, method) -> MethodAnalysis:
+        return MethodAnalysis(self.dex, method)
+
+
+class DexDecompiler:
+    """
+    This class decompiles the methods of a call graph built by build_call_graph. The dex file
+    defining a method is parsed by androguard the first time one of its methods is requested,
+    without the analysis of the whole APK.
+    """
+    def __init__(self, apk, class_dex: dict):
+        """
+        :param apk: androguard APK
+        :param class_dex: name of the dex file defining each class, as returned by build_call_graph
+        """
+        self.apk = apk
+        self.class_dex = class_dex
+        self.dex = {}
+        self.lock = threading.Lock()
+
+    def get_dex(self, dex_name: str) -> DEX:
+        with self.lock:
+            if dex_name not in self.dex:
+                dex = DEX(self.apk.get_file(dex_name), using_api=self.apk.get_target_sdk_version())
+                dex.set_decompiler(DecompilerDAD(dex, MethodAnalyses(dex)))
+                self.dex[dex_name] = dex
+            return self.dex[dex_name]
+
+    def get_method(self, method: MethodRef):
+        """
+        :param method: a node of the call graph
+        :return: the androguard EncodedMethod of the node, None if no dex file defines it
+        """
+        dex_name = self.class_dex.get(method.class_name)
+        if dex_name is None:
+            return None
+        return self.get_dex(dex_name).get_encoded_method_descriptor(*method.key())
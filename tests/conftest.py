@@ -0,0 +1,51 @@
+import os
+import zipfile
+
+import pytest
+
+from androcfg.call_graph_extractor import CFG
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.fixture(scope='session')
+def sample_apk():
+    # SampleApplication.apk bundled with androwarn
+    return os.path.join(DATA_DIR, 'sample.apk')
+
+
+@pytest.fixture(scope='session')
+def multidex_apk(sample_apk, tmp_path_factory):
+    """
+    The sample APK whose classes are defined three times, by classes.dex, classes2.dex and classes10.dex.
+    """
+    path = str(tmp_path_factory.mktemp('apk') / 'multidex.apk')
+    with zipfile.ZipFile(sample_apk) as sample, zipfile.ZipFile(path, mode='w') as apk:
+        for info in sample.infolist():
+            apk.writestr(info.filename, sample.read(info), compress_type=info.compress_type)
+        dex = sample.read('classes.dex')
+        apk.writestr('classes2.dex', dex, compress_type=zipfile.ZIP_STORED)
+        apk.writestr('classes10.dex', dex, compress_type=zipfile.ZIP_DEFLATED)
+    return path
+
+
+@pytest.fixture
+def cfg_options():
+    """
+    CFG options writing raw evidence inline and DOT call graphs, without any graphviz layout.
+    """
+    return {'output_file': 'raw', 'graph_format': 'dot', 'evidence_processes': 0}
+
+
+@pytest.fixture
+def run_cfg(cfg_options):
+    """
+    :return: a function analyzing an APK with CFG and returning the CFG, its rules computed
+    """
+    def run(apk_file, output_dir, **options):
+        c = CFG(apk_file, str(output_dir), **{**cfg_options, **options})
+        c.compute_rules()
+        c.renderer.join()
+        c.evidence_pool.join()
+        return c
+    return run
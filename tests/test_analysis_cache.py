@@ -0,0 +1,96 @@
+import shutil
+from collections import Counter
+
+import pytest
+from androguard.misc import AnalyzeAPK
+
+from androcfg.analysis_cache import AnalysisCache, MethodRef
+from androcfg.compact_graph import CompactCallGraph
+from androcfg.xref_graph import build_call_graph
+
+
+def analyze(apk_file):
+    apk, dex_list, dx = AnalyzeAPK(apk_file)
+    call_graph = CompactCallGraph.from_networkx(dx.get_call_graph())
+    index_order = [call_graph.ids[m.get_method()] for clazz in dx.get_classes() for m in clazz.get_methods()]
+    hierarchy = {clazz.name: (clazz.extends, list(clazz.implements)) for clazz in dx.get_classes()}
+    class_dex = {clazz.get_name(): name for name, dex in zip(apk.get_dex_names(), dex_list) for clazz in dex.get_classes()}
+    return call_graph, index_order, hierarchy, class_dex
+
+
+def build(apk_file):
+    call_graph, method_index, hierarchy, class_dex = build_call_graph(apk_file)
+    index_order = [call_graph.ids[m] for m in method_index]
+    return call_graph, index_order, hierarchy, class_dex
+
+
+def edges(call_graph) -> list:
+    sources, targets = call_graph.subgraph_edges(range(len(call_graph)))
+    return sorted(zip(sources.tolist(), targets.tolist()))
+
+
+@pytest.mark.parametrize('builder, compute', [(None, analyze), ('xref-test', build)])
+@pytest.mark.parametrize('apk', ['sample_apk', 'multidex_apk'])
+def test_round_trip(builder, compute, apk, request, tmp_path):
+    apk_file = request.getfixturevalue(apk)
+    call_graph, index_order, hierarchy, class_dex = compute(apk_file)
+    cache = AnalysisCache(str(tmp_path), builder)
+    assert cache.load(apk_file) is None
+    cache.save(apk_file, call_graph, index_order, hierarchy, class_dex)
+
+    cached = AnalysisCache(str(tmp_path), builder).load(apk_file)
+    keys = [(m.get_class_name(), m.get_name(), str(m.get_descriptor())) for m in call_graph.nodes]
+    assert [m.key() for m in cached.call_graph.nodes] == keys
+    assert edges(cached.call_graph) == edges(call_graph)
+    assert cached.index_order == index_order
+    assert cached.class_hierarchy == {k: tuple(v) for k, v in hierarchy.items()}
+    assert cached.class_dex == class_dex
+    # The nth node of a key is its nth copy, every node keeps its own id
+    copies = Counter(keys)
+    assert [m.copy for m in cached.call_graph.nodes].count(0) == len(copies)
+    assert len(cached.call_graph.ids) == len(call_graph)
+
+
+def test_copies(multidex_apk, tmp_path):
+    call_graph, index_order, hierarchy, class_dex = analyze(multidex_apk)
+    cache = AnalysisCache(str(tmp_path))
+    cache.save(multidex_apk, call_graph, index_order, hierarchy, class_dex)
+    nodes = cache.load(multidex_apk).call_graph.nodes
+    copies = {}
+    for m in nodes:
+        copies.setdefault(m.key(), []).append(m.copy)
+    assert max(len(c) for c in copies.values()) > 1
+    assert all(c == list(range(len(c))) for c in copies.values())
+    key = next(k for k, c in copies.items() if len(c) > 1)
+    assert MethodRef(*key) != MethodRef(*key, copy=1)
+    assert MethodRef(*key, copy=1) == MethodRef(*key, copy=1)
+    assert hash(MethodRef(*key, copy=1)) == hash(MethodRef(*key, copy=1))
+
+
+def test_invalidation(sample_apk, tmp_path):
+    apk_file = str(tmp_path / 'sample.apk')
+    shutil.copy(sample_apk, apk_file)
+    cache_dir = str(tmp_path / 'cache')
+    AnalysisCache(cache_dir, 'xref-1').save(apk_file, *build(apk_file))
+    assert AnalysisCache(cache_dir, 'xref-1').load(apk_file) is not None
+    # Another builder, or another version of it
+    assert AnalysisCache(cache_dir).load(apk_file) is None
+    assert AnalysisCache(cache_dir, 'xref-2').load(apk_file) is None
+    # Another APK at the same path
+    with open(apk_file, mode='ab') as apk:
+        apk.write(b'\0')
+    assert AnalysisCache(cache_dir, 'xref-1').load(apk_file) is None
+
+
+@pytest.mark.parametrize('xref_graph', [False, True])
+@pytest.mark.parametrize('apk', ['sample_apk', 'multidex_apk'])
+def test_cached_run(xref_graph, apk, request, run_cfg, tmp_path):
+    apk_file = request.getfixturevalue(apk)
+    cache_dir = str(tmp_path / 'cache')
+    first = run_cfg(apk_file, tmp_path / 'first', cache_dir=cache_dir, xref_graph=xref_graph)
+    second = run_cfg(apk_file, tmp_path / 'second', cache_dir=cache_dir, xref_graph=xref_graph)
+    assert isinstance(second.call_graph.nodes[0], MethodRef)
+    # The methods quoted by findings are decompiled without analyzing the APK again
+    assert second.analysis is None
+    assert second.report == first.report
+    assert second.genom.dumps() == first.genom.dumps()
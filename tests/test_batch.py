@@ -0,0 +1,36 @@
+import os
+import time
+
+import androcfg.batch
+from androcfg.batch import MAX_ATTEMPTS, Batch
+
+
+def fake_analyze_apk(apk_file: str, output_dir: str, options: dict, timeout: float = None) -> dict:
+    # Counts the runs of each APK in the directory of the batch
+    with open(f'{os.path.dirname(output_dir)}/runs.txt', mode='a') as runs:
+        runs.write(os.path.basename(apk_file) + '\n')
+    if 'crash' in apk_file:
+        time.sleep(0.2)
+        os._exit(1)
+    time.sleep(0.5)
+    return {'apk': apk_file, 'output_dir': output_dir, 'status': 'done'}
+
+
+def test_worker_crash(monkeypatch, tmp_path):
+    monkeypatch.setattr(androcfg.batch, 'analyze_apk', fake_analyze_apk)
+    apks = [f'/apks/{name}.apk' for name in ('a', 'b', 'crash', 'c', 'd', 'e')]
+    output_dir = str(tmp_path / 'output')
+    index = Batch(output_dir, jobs=4).run(apks)
+
+    status = {os.path.basename(record['apk']): record['status'] for record in index}
+    # The APKs running next to the crashing one are retried alone, and never charged
+    assert status == {'a.apk': 'done', 'b.apk': 'done', 'crash.apk': 'failed',
+                      'c.apk': 'done', 'd.apk': 'done', 'e.apk': 'done'}
+    assert index[2]['error'] == 'worker process crashed'
+    with open(f'{output_dir}/runs.txt') as runs:
+        counts = {}
+        for line in runs:
+            counts[line.strip()] = counts.get(line.strip(), 0) + 1
+    # Once in the shared pool, then MAX_ATTEMPTS times alone
+    assert counts['crash.apk'] == 1 + MAX_ATTEMPTS
+    assert all(counts[name] <= 2 for name in counts if name != 'crash.apk')
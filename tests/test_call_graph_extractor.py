@@ -0,0 +1,67 @@
+import os
+import threading
+import time
+
+import pytest
+
+import androcfg.dekofuzzy as dekofuzzy
+from androcfg.call_graph_extractor import CFG
+from androcfg.compact_graph import CompactCallGraph
+from androcfg.limits import AnalysisAborted, wall_clock_limit
+
+
+def test_abort_stops_rules(sample_apk, tmp_path, cfg_options):
+    c = CFG(sample_apk, str(tmp_path), **{**cfg_options, 'rule_workers': 4})
+    c.compute_apk_call_graph()
+    get_source = c.sources.get
+    submitted = []
+
+    def slow_get(method):
+        time.sleep(0.2)
+        return get_source(method)
+
+    def submit(*args):
+        submitted.append(args)
+    c.sources.get = slow_get
+    c.evidence_pool.submit = submit
+    c.renderer.submit = submit
+    with pytest.raises(AnalysisAborted):
+        with wall_clock_limit(0.1):
+            c.compute_rules()
+    c.abort()
+    count = len(submitted)
+    # Every rule thread has stopped, none of them renders anything after the abort
+    assert threading.active_count() == 1
+    time.sleep(0.5)
+    assert len(submitted) == count
+
+
+def test_inline_evidence_by_default(sample_apk, tmp_path):
+    # A library caller gets no process pool it did not ask for
+    c = CFG(sample_apk, str(tmp_path), 'png', graph_format='dot')
+    c.compute_rules()
+    c.evidence_pool.join()
+    assert c.evidence_pool.max_processes == 0
+    assert c.evidence_pool.pool is None
+    assert os.listdir(tmp_path / 'code')
+
+
+@pytest.mark.parametrize('rule_workers', [1, 4])
+def test_compact_graph(sample_apk, tmp_path, run_cfg, rule_workers):
+    graph = run_cfg(sample_apk, tmp_path / 'networkx')
+    compact = run_cfg(sample_apk, tmp_path / 'compact', compact_graph=True, rule_workers=rule_workers)
+    assert isinstance(compact.call_graph, CompactCallGraph)
+    assert not isinstance(graph.call_graph, CompactCallGraph)
+    assert compact.genom.dumps() == graph.genom.dumps()
+    assert compact.report == graph.report
+    assert any(rule_report['findings'] for rule_report in graph.report)
+
+
+def test_dexofuzzy_without_pool(multidex_apk, tmp_path, run_cfg, monkeypatch):
+    # Batch workers and library callers hash the dex files one by one
+    expected = dekofuzzy.hash_apk(multidex_apk, max_workers=1)
+    monkeypatch.setattr(dekofuzzy, 'ProcessPoolExecutor', None)
+    c = run_cfg(multidex_apk, tmp_path, xref_graph=True, apk_dexofuzzy=True)
+    assert c.dalvik_format_list is None
+    assert c.compute_apk_dexofuzzy() == expected
+    assert len(expected['dex']) == 3
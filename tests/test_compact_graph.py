@@ -0,0 +1,37 @@
+import networkx as nx
+import pytest
+from androguard.misc import AnalyzeAPK
+
+from androcfg.compact_graph import CompactCallGraph
+
+
+@pytest.fixture(scope='module')
+def call_graph(sample_apk):
+    return AnalyzeAPK(sample_apk)[2].get_call_graph()
+
+
+def test_from_networkx(call_graph):
+    compact = CompactCallGraph.from_networkx(call_graph)
+    assert compact.nodes == list(call_graph.nodes())
+    assert compact.number_of_edges() == call_graph.number_of_edges()
+    assert list(compact.in_degree()) == list(call_graph.in_degree())
+    assert list(compact.out_degree()) == list(call_graph.out_degree())
+    for i, n in enumerate(compact.nodes):
+        assert [compact.nodes[j] for j in compact.successor_ids(i)] == list(call_graph.successors(n))
+        assert sorted(compact.predecessor_ids(i).tolist()) == sorted(compact.ids[p] for p in call_graph.predecessors(n))
+
+
+def test_ancestors(call_graph):
+    compact = CompactCallGraph.from_networkx(call_graph)
+    for n in compact.nodes:
+        assert compact.ancestors(n) == nx.ancestors(call_graph, n)
+
+
+def test_subgraph(call_graph):
+    compact = CompactCallGraph.from_networkx(call_graph)
+    for n in compact.nodes:
+        nodes = nx.ancestors(call_graph, n) | {n}
+        expected = call_graph.subgraph(nodes)
+        subgraph = compact.subgraph(nodes)
+        assert set(subgraph.nodes()) == set(expected.nodes())
+        assert set(subgraph.edges()) == set(expected.edges())
@@ -0,0 +1,77 @@
+import os
+import random
+
+import pytest
+
+from androcfg.dekofuzzy import ExtractOpcode, FastExtractOpcode, skip_10x
+
+# classes.dex of the SampleApplication bundled with androwarn
+DEX_FILE = os.path.join(os.path.dirname(__file__), 'data', 'classes.dex')
+
+# nop, whose next byte is the ident of a payload, other 10x opcodes and the payload idents
+PAYLOAD_BYTES = [0x00, 0x0e, 0x73, 0xe3, 0x01, 0x02, 0x03]
+
+
+@pytest.fixture(scope='module')
+def dex_data():
+    with open(DEX_FILE, mode='rb') as dex_file:
+        return dex_file.read()
+
+
+def get_bytecode(extractor_class, bytecode: bytes, offset: int, size: int):
+    extractor = extractor_class()
+    extractor.dex = bytecode
+    try:
+        extractor.get_bytecode(offset, size)
+    except IndexError:
+        return IndexError
+    return extractor.opcodes_in_method
+
+
+def test_get_opcodes(dex_data):
+    opcodes = ExtractOpcode().get_opcodes(dex_data)
+    assert opcodes
+    assert FastExtractOpcode().get_opcodes(dex_data) == opcodes
+
+
+def test_get_opcodes_memoryview(dex_data):
+    opcodes = ExtractOpcode().get_opcodes(dex_data)
+    with memoryview(dex_data) as view:
+        assert FastExtractOpcode().get_opcodes(view) == opcodes
+
+
+def test_get_opcodes_not_dex_data():
+    assert FastExtractOpcode().get_opcodes('classes.dex') == ExtractOpcode().get_opcodes('classes.dex') == []
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_get_bytecode_fuzz(seed):
+    rnd = random.Random(seed)
+    index_errors = 0
+    for _ in range(5000):
+        size = rnd.randint(0, 40)
+        # Weighted to payloads, including truncated ones running past the bytecode or the data
+        bytecode = bytes(rnd.choice(PAYLOAD_BYTES + [rnd.randrange(256)])
+                         for _ in range(size + rnd.randint(0, 3)))
+        offset = rnd.randint(0, 3)
+        bytecode_size = rnd.randint(0, size)
+        expected = get_bytecode(ExtractOpcode, bytecode, offset, bytecode_size)
+        assert get_bytecode(FastExtractOpcode, bytecode, offset, bytecode_size) == expected, \
+            (bytecode.hex(), offset, bytecode_size)
+        index_errors += expected is IndexError
+    # Both classes raise IndexError when the bytecode runs out of the data
+    assert index_errors
+
+
+def test_get_bytecode_random_method():
+    rnd = random.Random(0)
+    bytecode = bytes(rnd.randrange(256) for _ in range(65534))
+    assert get_bytecode(FastExtractOpcode, bytecode, 0, len(bytecode)) == \
+        get_bytecode(ExtractOpcode, bytecode, 0, len(bytecode))
+
+
+def test_skip_10x_fill_array_size():
+    # fill-array-data-payload of 0x10010 one-byte elements, ExtractOpcode only reads 0x10 of them
+    bytecode = bytes([0x00, 0x03, 0x01, 0x00, 0x10, 0x00, 0x01, 0x00]) + bytes(0x10010)
+    assert skip_10x(bytecode, 0, len(bytecode)) == 8 + 0x10
+    assert skip_10x(bytecode, 0, len(bytecode), array_size_bytes=4) == 8 + 0x10010
@@ -0,0 +1,44 @@
+import os
+import time
+
+from PIL import Image, ImageChops
+from pygments import highlight
+from pygments.formatters import ImageFormatter
+from pygments.lexers.jvm import JavaLexer
+
+from androcfg.call_graph_extractor import CFG
+from androcfg.code_style import U39bStyle
+from androcfg.evidence_renderer import EvidencePool, EvidenceRenderer
+
+JAVA_CODE = '\n'.join(f'    int field{i} = {i};' for i in range(400))
+
+
+def test_terminate(tmp_path):
+    pool = EvidencePool(2)
+    for i in range(4):
+        pool.submit('png', JAVA_CODE, f'Lcom/example/Class{i};', str(tmp_path / f'{i}.png'))
+    pool.terminate()
+    files = sorted(os.listdir(tmp_path))
+    # Renders in flight are done or dropped, none of them writes after terminate
+    assert all(not name.startswith('.') for name in files)
+    pool.submit('raw', JAVA_CODE, 'Lcom/example/Late;', str(tmp_path / 'late.java'))
+    time.sleep(0.5)
+    assert sorted(os.listdir(tmp_path)) == files
+
+
+def test_render_as_append_legend(tmp_path):
+    # Highlighted as a BMP file, then given its legend in place
+    image_file = str(tmp_path / 'highlight.bmp')
+    with open(image_file, mode='wb') as out:
+        out.write(highlight(JAVA_CODE, JavaLexer(), ImageFormatter(style=U39bStyle,
+                                                                   image_format='BMP',
+                                                                   font_name='DejaVu Sans Mono',
+                                                                   line_pad=4,
+                                                                   font_size=12,
+                                                                   line_number_bg='#A991D4',
+                                                                   line_number_fg='#ffffff')))
+    CFG.append_legend(image_file, 'Lcom/example/Class;', 12)
+    rendered = EvidenceRenderer().render(JAVA_CODE, 'Lcom/example/Class;')
+    with Image.open(image_file) as expected:
+        assert rendered.size == expected.size
+        assert ImageChops.difference(rendered, expected.convert(rendered.mode)).getbbox() is None
@@ -0,0 +1,68 @@
+import random
+
+import numpy as np
+import pytest
+
+from androcfg.call_graph_extractor import CLUSTERS, RULES_FILE
+from androcfg.genom import METRICS, Genom, parse, sparse_compare, stack
+
+
+def genomes(seed: int):
+    """
+    :return: a dense and a sparse genome holding the same random genes
+    """
+    rnd = random.Random(seed)
+    dense = Genom(RULES_FILE, list(CLUSTERS.keys()))
+    sparse = Genom(RULES_FILE, list(CLUSTERS.keys()), sparse=True)
+    for _ in range(rnd.randint(0, 20)):
+        gene = rnd.choice(dense.genes)
+        dense.add_gene(*gene)
+        sparse.add_gene(*gene)
+    return dense, sparse
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_sparse_as_dense(seed):
+    dense, sparse = genomes(seed)
+    assert np.array_equal(sparse.sequence, dense.sequence)
+    for sparse_array, dense_array in zip(sparse.get_sparse(), dense.get_sparse()):
+        assert np.array_equal(sparse_array, dense_array)
+    assert np.array_equal(parse(sparse.dumps(), len(sparse)), parse(dense.dumps()))
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_dump_load(tmp_path, seed):
+    dense, sparse = genomes(seed)
+    for genome in (dense, sparse):
+        for write in ('dump', 'save'):
+            path = str(tmp_path / f'{write}-{int(genome.sparse)}')
+            getattr(genome, write)(path)
+            # Either file is read by a dense and by a sparse genome
+            for loaded in genomes(seed + 100):
+                loaded.load(path)
+                assert np.array_equal(loaded.sequence, dense.sequence)
+                assert loaded.dumps() == (sparse if loaded.sparse else dense).dumps()
+
+
+@pytest.mark.parametrize('metric', ['cosine', 'jaccard', 'hamming'])
+def test_compare(metric):
+    pairs = [genomes(seed) for seed in range(30)]
+    matrix = stack([dense.sequence for dense, _ in pairs])
+    for dense, sparse in pairs[:10]:
+        expected = METRICS[metric](dense.sequence, matrix)
+        assert dense.compare(matrix, metric) == pytest.approx(expected)
+        assert sparse.compare(matrix, metric) == pytest.approx(expected)
+        assert sparse.compare([s for _, s in pairs], metric) == pytest.approx(expected)
+        assert dense.compare([d for d, _ in pairs], metric) == pytest.approx(expected)
+    empty = (np.zeros(0, dtype=np.int64), np.zeros(0))
+    assert sparse_compare(empty, [], metric).shape == (0,)
+    assert sparse_compare(empty, [empty], metric) == pytest.approx(METRICS[metric](np.zeros(1), np.zeros((1, 1))))
+
+
+def test_sparse_cfg(sample_apk, tmp_path, run_cfg):
+    dense = run_cfg(sample_apk, tmp_path / 'dense')
+    sparse = run_cfg(sample_apk, tmp_path / 'sparse', sparse_genom=True)
+    assert sparse.genom.sparse
+    assert np.any(dense.genom.sequence)
+    assert np.array_equal(sparse.genom.sequence, dense.genom.sequence)
+    assert sparse.report == dense.report
@@ -0,0 +1,93 @@
+import json
+import multiprocessing
+import random
+import threading
+
+import numpy as np
+import pytest
+
+from androcfg.genom import GENE_DTYPE, METRICS
+from androcfg.genom_corpus import GenomCorpus
+
+GENES = [(cluster, f'Lcom/example/Api;/call{i}') for i in range(12) for cluster in ('ads', 'unknown')]
+
+
+def random_sequence(rnd: random.Random) -> np.ndarray:
+    sequence = np.zeros(len(GENES), dtype=GENE_DTYPE)
+    for i in rnd.sample(range(len(GENES)), rnd.randint(0, 6)):
+        sequence[i] = rnd.randint(1, 4)
+    return sequence
+
+
+@pytest.mark.parametrize('metric', ['jaccard', 'cosine', 'hamming'])
+def test_query(tmp_path, metric):
+    rnd = random.Random(metric)
+    corpus = GenomCorpus(str(tmp_path), GENES)
+    sequences = [random_sequence(rnd) for _ in range(300)]
+    # Added in batches and one by one, queried in between so the index grows in several segments
+    corpus.add_many(sequences[:100], [{'sha256': f'{i:064x}'} for i in range(100)])
+    for i, sequence in enumerate(sequences[100:], start=100):
+        corpus.add(sequence, {'sha256': f'{i:064x}'})
+        if i % 20 == 0:
+            corpus.query(sequence, 5, metric)
+    assert np.array_equal(corpus.get_matrix(), np.vstack(sequences))
+    for _ in range(20):
+        sequence = random_sequence(rnd)
+        expected = METRICS[metric](sequence, np.vstack(sequences))
+        top = corpus.query(sequence, 10, metric)
+        # The smallest hamming distances, the highest similarities
+        best = sorted(expected, reverse=metric != 'hamming')[:10]
+        assert [score for _, score in top] == pytest.approx(best)
+        for row, score in top:
+            assert expected[row] == pytest.approx(score)
+
+
+def test_reopen(tmp_path):
+    rnd = random.Random(0)
+    corpus = GenomCorpus(str(tmp_path), GENES)
+    sequences = [random_sequence(rnd) for _ in range(10)]
+    rows = corpus.add_many(sequences + sequences[:2], [{'sha256': f'{i % 10:064x}'} for i in range(12)])
+    # A sample is stored once per sha256
+    assert rows == list(range(10)) + [0, 1]
+    corpus = GenomCorpus(str(tmp_path))
+    assert len(corpus) == 10
+    assert corpus.contains(f'{3:064x}')
+    assert np.array_equal(corpus.get_matrix(), np.vstack(sequences))
+    with pytest.raises(ValueError):
+        GenomCorpus(str(tmp_path), GENES[:-1])
+    with pytest.raises(FileNotFoundError):
+        GenomCorpus(str(tmp_path / 'missing'))
+
+
+def add_samples(corpus_dir: str, start: int, count: int):
+    corpus = GenomCorpus(corpus_dir, GENES)
+    rnd = random.Random(start)
+    for i in range(start, start + count):
+        corpus.add(random_sequence(rnd) + 1, {'sha256': f'{i:064x}', 'apk': f'{i}.apk'})
+
+
+def test_concurrent_add(tmp_path):
+    corpus_dir = str(tmp_path)
+    corpus = GenomCorpus(corpus_dir, GENES)
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=add_samples, args=(corpus_dir, 1000 * (i + 1), 50)) for i in range(3)]
+    for process in processes:
+        process.start()
+    # Threads sharing one corpus write along the processes
+    rnd = random.Random(0)
+    threads = [threading.Thread(target=lambda i=i: [corpus.add(random_sequence(rnd) + 1, {'sha256': f'{j:064x}'})
+                                                     for j in range(i * 50, i * 50 + 50)]) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0, 0, 0]
+    corpus = GenomCorpus(corpus_dir)
+    assert len(corpus) == 300
+    assert len(corpus.digests) == 300
+    with open(corpus.samples_file) as samples_file:
+        assert [json.loads(line) for line in samples_file] == corpus.samples
+    # Every row holds a genome, all genes of the samples above being present
+    assert np.all(corpus.get_matrix() > 0)
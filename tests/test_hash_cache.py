@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import sqlite3
+
+import pytest
+
+import androcfg.dekofuzzy as dekofuzzy
+from androcfg.dex_tables import DexTables
+from androcfg.hash_cache import HASH_CACHE_FORMAT, HashCache
+
+# classes.dex of the SampleApplication bundled with androwarn
+DEX_FILE = os.path.join(os.path.dirname(__file__), 'data', 'classes.dex')
+
+
+@pytest.fixture(scope='module')
+def bytecodes():
+    """
+    The bytecode of every method of the sample, each one once
+    """
+    with open(DEX_FILE, mode='rb') as dex_file:
+        dex = DexTables(dex_file.read())
+    bytecodes = {}
+    for _, _, _, class_data_off in dex.get_class_defs():
+        for _, code_off in dex.get_class_methods(class_data_off):
+            if code_off:
+                bytecode = dex.dex[code_off + 16:code_off + 16 + 2 * dex.get_insns_size(code_off)]
+                bytecodes.setdefault(bytecode, None)
+    return list(bytecodes)
+
+
+def count(path) -> int:
+    with sqlite3.connect(path) as db:
+        return db.execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
+
+
+def test_round_trip(tmp_path, bytecodes):
+    path = str(tmp_path / 'hashes.db')
+    cache = HashCache(path, flush_every=8)
+    assert cache.get(bytecodes[0]) is None
+    hashes = [cache.hash(bytecode) for bytecode in bytecodes]
+    assert hashes == [dekofuzzy.hash(bytecode) for bytecode in bytecodes]
+    # Buffered entries are served before they are flushed
+    assert cache.get(bytecodes[-1])[1] == hashes[-1]
+    cache.close()
+    assert count(path) == len(bytecodes)
+
+    cache = HashCache(path)
+    for bytecode, dexofuzzy_hash in zip(bytecodes, hashes):
+        opcodes, cached_hash = cache.get(bytecode)
+        assert opcodes == dekofuzzy.extract_bytecode(bytecode)
+        assert cached_hash == dexofuzzy_hash
+    cache.close()
+
+
+def fill(path, bytecodes):
+    cache = HashCache(path, flush_every=4)
+    for bytecode in bytecodes:
+        cache.hash(bytecode)
+    cache.close()
+
+
+def test_concurrent_writers(tmp_path, bytecodes):
+    path = str(tmp_path / 'hashes.db')
+    context = multiprocessing.get_context('fork')
+    # Overlapping shares, an entry written by several processes is stored once
+    processes = [context.Process(target=fill, args=(path, bytecodes[i::3] + bytecodes[:10])) for i in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0, 0, 0]
+    assert count(path) == len(bytecodes)
+    cache = HashCache(path)
+    assert all(cache.get(bytecode)[1] == dekofuzzy.hash(bytecode) for bytecode in bytecodes)
+    assert cache._size() == sum(len(','.join(opcodes)) + len(h)
+                                for opcodes, h in (cache.get(bytecode) for bytecode in bytecodes))
+    cache.close()
+
+
+def test_format_mismatch(tmp_path, bytecodes):
+    path = str(tmp_path / 'hashes.db')
+    fill(path, bytecodes)
+    with sqlite3.connect(path) as db:
+        db.execute("UPDATE meta SET value = ? WHERE key = 'format'", (HASH_CACHE_FORMAT + 1,))
+    # Entries of another format are dropped, never read
+    cache = HashCache(path)
+    assert cache.get(bytecodes[0]) is None
+    assert cache._size() == 0
+    cache.close()
+    assert count(path) == 0
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT value FROM meta WHERE key = 'format'").fetchone()[0] == HASH_CACHE_FORMAT
+
+
+def test_eviction(tmp_path, bytecodes):
+    path = str(tmp_path / 'hashes.db')
+    cache = HashCache(path, max_size=2000, flush_every=4)
+    for bytecode in bytecodes:
+        cache.hash(bytecode)
+    cache.close()
+    cache = HashCache(path, max_size=2000)
+    assert 0 < cache._size() <= 2000
+    # The most recently used entry is kept
+    assert cache.get(bytecodes[-1]) is not None
+    cache.close()
@@ -0,0 +1,44 @@
+import pytest
+from androguard.misc import AnalyzeAPK
+
+from androcfg.call_graph_extractor import CLUSTERS, RULES_FILE
+from androcfg.method_index import MethodIndex, literal_prefix
+from androcfg.rule_pack import RulePack
+
+
+@pytest.fixture(scope='module')
+def analysis(sample_apk):
+    return AnalyzeAPK(sample_apk)[2]
+
+
+def patterns() -> list:
+    """
+    The class and method patterns of the default rules, then patterns exercising the regular expressions
+    """
+    keys = list(RulePack.read(RULES_FILE, list(CLUSTERS.keys())).keys.values())
+    keys += [(class_name.rpartition('/')[0] + '/.*', method_name) for class_name, method_name in keys]
+    keys += [('Landroid/', 'get'), ('L', ''), ('.*', 'on[A-Z]'), ('Ljava/lang/(String|Object);', '<init>'),
+             ('Landroid/telephony/TelephonyManager;', 'getDevice(Id)?$'), ('Lnot/in/the/Apk;', '.*')]
+    return keys
+
+
+def test_find(analysis):
+    index = MethodIndex(analysis)
+    found = 0
+    for class_name, method_name in patterns():
+        expected = list(analysis.find_methods(classname=class_name, methodname=method_name))
+        assert index.find(class_name, method_name) == expected, (class_name, method_name)
+        found += len(expected)
+    assert found
+
+
+@pytest.mark.parametrize('pattern,prefix', [
+    ('Landroid/telephony/TelephonyManager;', 'Landroid/telephony/TelephonyManager;'),
+    ('Landroid/.*', 'Landroid/'),
+    ('getDevice(Id)?', 'getDevice'),
+    ('getDevice?', 'getDevic'),
+    ('Ljava/lang/(String|Object);', ''),
+    ('.*', ''),
+])
+def test_literal_prefix(pattern, prefix):
+    assert literal_prefix(pattern) == prefix
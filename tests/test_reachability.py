@@ -0,0 +1,78 @@
+import random
+
+import networkx as nx
+import pytest
+
+from androcfg.compact_graph import CompactCallGraph
+from androcfg.reachability import Reachability
+
+
+def random_graph(seed: int) -> nx.DiGraph:
+    rnd = random.Random(seed)
+    size = rnd.randint(1, 60)
+    nodes = list(range(size))
+    rnd.shuffle(nodes)
+    graph = nx.DiGraph()
+    graph.add_nodes_from(nodes)
+    # Sparse as call graphs are, with cycles and self-loops
+    for _ in range(rnd.randint(0, 2 * size)):
+        graph.add_edge(rnd.choice(nodes), rnd.choice(nodes))
+    return graph
+
+
+def ancestor_subgraph(graph: nx.DiGraph, targets: list) -> nx.DiGraph:
+    """
+    The union of the call graph restricted to the ancestors of each target, as the rules built it
+    """
+    result = nx.DiGraph()
+    for target in targets:
+        selected = nx.ancestors(graph, target) | {target}
+        result.add_edges_from((u, v) for u in graph if u in selected for v in graph.successors(u) if v in selected)
+    return result
+
+
+def check(graph: nx.DiGraph, targets: list, rnd: random.Random):
+    reachability = Reachability(graph, targets)
+    bits = [reachability.mask(t) for t in dict.fromkeys(targets)]
+    assert all(bits) and len(set(bits)) == len(bits)
+    assert all(bit & (bit - 1) == 0 for bit in bits)
+    for target in targets:
+        ancestors = nx.ancestors(graph, target) | {target}
+        labelled = {n for n, label in zip(reachability.nodes, reachability.labels) if label & reachability.mask(target)}
+        assert labelled == ancestors
+        assert reachability.roots(target) == [n for n in graph if n in ancestors and graph.in_degree(n) == 0]
+    for _ in range(5):
+        selected = rnd.sample(targets, rnd.randint(0, len(targets))) + rnd.sample(targets, 1)
+        expected = ancestor_subgraph(graph, selected)
+        subgraph = reachability.subgraph(selected)
+        assert list(subgraph.edges()) == list(expected.edges())
+        assert list(subgraph.nodes()) == list(expected.nodes())
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_random_graph(seed):
+    rnd = random.Random(seed)
+    graph = random_graph(seed)
+    nodes = list(graph)
+    targets = rnd.sample(nodes, rnd.randint(1, min(len(nodes), 8)))
+    check(graph, targets, rnd)
+    # Same labels on the compact graph
+    compact = CompactCallGraph.from_networkx(graph)
+    assert Reachability(compact, targets).labels == Reachability(graph, targets).labels
+
+
+def test_deep_chain():
+    # Deeper than the recursion limit
+    size = 5000
+    graph = nx.DiGraph()
+    graph.add_edges_from((i, i + 1) for i in range(size - 1))
+    graph.add_edge(size - 1, size // 2)
+    check(graph, [size - 1, size // 3, 0], random.Random(0))
+
+
+def test_target_not_in_graph():
+    graph = nx.DiGraph([(0, 1)])
+    reachability = Reachability(graph, [1, 2])
+    assert reachability.mask(2) == 0
+    assert reachability.roots(2) == []
+    assert list(reachability.subgraph([2, 1]).edges()) == [(0, 1)]
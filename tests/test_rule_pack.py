@@ -0,0 +1,81 @@
+import json
+import os
+import pickle
+
+import pytest
+
+from androcfg.call_graph_extractor import CLUSTERS, RULES_FILE
+from androcfg.rule_pack import RULE_PACK_FORMAT, RULE_PACK_MAGIC, RulePack, load_rule_pack
+
+CLUSTER_NAMES = list(CLUSTERS.keys())
+
+
+@pytest.fixture
+def pack_file(tmp_path):
+    path = str(tmp_path / 'rules.pack')
+    RulePack.read(RULES_FILE, CLUSTER_NAMES).save(path)
+    return path
+
+
+def test_load(pack_file):
+    compiled = RulePack.read(RULES_FILE, CLUSTER_NAMES)
+    loaded = RulePack.read(pack_file, CLUSTER_NAMES)
+    assert vars(loaded) == vars(compiled)
+
+
+def test_findings(sample_apk, tmp_path, pack_file, run_cfg):
+    rules = run_cfg(sample_apk, tmp_path / 'rules')
+    pack = run_cfg(sample_apk, tmp_path / 'pack', rules_file=pack_file)
+    assert pack.rule_pack.version == rules.rule_pack.version
+    assert pack.genom.dumps() == rules.genom.dumps()
+    assert pack.report == rules.report
+    assert any(rule_report['findings'] for rule_report in rules.report)
+
+
+def write_pack(path: str, content: bytes) -> str:
+    with open(path, mode='wb') as pack_file:
+        pack_file.write(content)
+    return path
+
+
+def test_bad_magic(tmp_path, pack_file):
+    with open(pack_file, mode='rb') as f:
+        content = f.read()
+    path = write_pack(str(tmp_path / 'bad.pack'), b'XCFGPACK' + content[len(RULE_PACK_MAGIC):])
+    with pytest.raises(ValueError):
+        RulePack.read(path, CLUSTER_NAMES)
+    # Packs of format 1 were pickled, they are rejected without being unpickled
+    path = write_pack(str(tmp_path / 'pickled.pack'), RULE_PACK_MAGIC + pickle.dumps({'format': 1}))
+    with pytest.raises(ValueError, match='compile it again'):
+        RulePack.read(path, CLUSTER_NAMES)
+
+
+def test_bad_format(tmp_path, pack_file):
+    with open(pack_file, mode='rb') as f:
+        data = json.loads(f.read()[len(RULE_PACK_MAGIC):])
+    data['format'] = RULE_PACK_FORMAT + 1
+    path = write_pack(str(tmp_path / 'next.pack'), RULE_PACK_MAGIC + json.dumps(data).encode())
+    with pytest.raises(ValueError, match=f'format {RULE_PACK_FORMAT + 1}'):
+        RulePack.read(path, CLUSTER_NAMES)
+
+
+def test_other_clusters(pack_file):
+    with pytest.raises(ValueError, match='other entrypoint clusters'):
+        RulePack.read(pack_file, CLUSTER_NAMES[:-1])
+
+
+def test_load_rule_pack(tmp_path):
+    path = str(tmp_path / 'rules.json')
+    with open(RULES_FILE) as rules_file:
+        rules = json.load(rules_file)
+    with open(path, mode='w') as rules_file:
+        json.dump(rules, rules_file)
+    pack = load_rule_pack(path, CLUSTER_NAMES)
+    assert load_rule_pack(path, CLUSTER_NAMES) is pack
+    # Read again once the file changes
+    with open(path, mode='w') as rules_file:
+        json.dump(rules[:1], rules_file)
+    os.utime(path, ns=(0, 0))
+    changed = load_rule_pack(path, CLUSTER_NAMES)
+    assert changed is not pack
+    assert changed.rules == rules[:1]